@@ -0,0 +1,377 @@
+"""
+Asynchronous serving mode for FiNER, for an ASGI server such as uvicorn:
+
+    uvicorn asgi:app
+
+Requests are accepted on an event loop and the tagging runs in bounded
+pools of executor threads, one per worker process of server.tagger for
+small texts and FINER_ASYNC_MAX_LARGE, by default one fewer, for large
+ones, so that a worker is always left for the small ones. Without
+FINER_WORKERS there is a single thread for both, as the in-process tagger
+is not thread safe. Small texts sent to / by concurrent clients are coalesced into one
+tag_many() call, waiting at most FINER_ASYNC_WINDOW_MS for company.
+
+Admission is bounded: once FINER_ASYNC_MAX_QUEUE requests are waiting or
+running, further ones get 503, and once FINER_ASYNC_MAX_LARGE texts larger
+than FINER_ASYNC_LARGE_BYTES are, further large ones get 429, so a burst of
+large documents can't starve the small ones. Both come with a Retry-After
+header estimated from recent tagging times.
+
+Every other route, and requests to / with a raw or compressed body, are
+served by the Flask app in server.py.
+"""
+import asyncio
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+import columnar
+import finer
+import metrics
+import server
+import transport
+
+window = float(os.environ.get("FINER_ASYNC_WINDOW_MS", 5)) / 1000
+max_queue = int(os.environ.get("FINER_ASYNC_MAX_QUEUE", 256))
+large_bytes = int(os.environ.get("FINER_ASYNC_LARGE_BYTES", 16384))
+threads = max(1, server.worker_count)
+max_large = max(1, int(os.environ.get("FINER_ASYNC_MAX_LARGE", threads - 1)))
+
+executor = ThreadPoolExecutor(threads, thread_name_prefix="finer-tag")
+if server.worker_count > 0:
+    large_executor = ThreadPoolExecutor(max_large, thread_name_prefix="finer-tag-large")
+else:
+    large_executor = executor
+
+class Overloaded(Exception):
+    def __init__(self, status, message, retry_after):
+        Exception.__init__(self, message)
+        self.status = status
+        self.retry_after = retry_after
+
+class Admission:
+    """
+    Counts the requests waiting for or running in the executor and turns
+    away those that would exceed the limits.
+    """
+    def __init__(self):
+        self.queued = 0
+        self.large = 0
+        # Moving average of executor seconds per request
+        self.seconds = 0.05
+
+    def retry_after(self):
+        return max(1, int(math.ceil(self.seconds * self.queued / threads)))
+
+    def enter(self, large=False):
+        if self.queued >= max_queue:
+            server.stats.count("rejected")
+            raise Overloaded(503, "Error - FiNER is busy, try again later", self.retry_after())
+        if large and self.large >= max_large:
+            server.stats.count("rejected")
+            raise Overloaded(429, "Error - Too many large texts are being tagged, try again later", self.retry_after())
+        self.queued += 1
+        if large:
+            self.large += 1
+
+    def leave(self, large=False):
+        self.queued -= 1
+        if large:
+            self.large -= 1
+
+    def observe(self, seconds, requests=1):
+        self.seconds = 0.9 * self.seconds + 0.1 * seconds / requests
+
+admission = Admission()
+
+def timed_job(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+class Coalescer:
+    """
+    Collects small texts into batches of up to server.batch_size, tagged
+    with a single tag_many() call once the batch is full or the latency
+    window has passed since its first text arrived.
+    """
+    def __init__(self):
+        self.batches = {True: [], False: []}
+        self.timers = {}
+
+    async def tag(self, text, tokenize):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self.batches[tokenize]
+        batch.append((text, future))
+        if len(batch) >= server.batch_size:
+            self.flush(tokenize)
+        elif len(batch) == 1:
+            self.timers[tokenize] = loop.call_later(window, self.flush, tokenize)
+        return await future
+
+    def flush(self, tokenize):
+        timer = self.timers.pop(tokenize, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self.batches[tokenize]
+        self.batches[tokenize] = []
+        if not batch:
+            return
+        timings = metrics.Timings() if server.metrics_enabled else None
+        server.stats.count("coalesced_batches")
+        job = asyncio.get_running_loop().run_in_executor(executor, timed_job, server.tagger.tag_many,
+                                                         [text for text, future in batch], tokenize, timings)
+
+        def done(job):
+            if job.exception() is not None:
+                for text, future in batch:
+                    if not future.done():
+                        future.set_exception(job.exception())
+                return
+            results, seconds = job.result()
+            admission.observe(seconds, len(batch))
+            if timings is not None:
+                server.stats.observe(timings)
+            for (text, future), sentences in zip(batch, results):
+                if not future.done():
+                    future.set_result(sentences)
+        job.add_done_callback(done)
+
+coalescer = Coalescer()
+
+async def read_body(receive, limit=0):
+    # The request body, or None if it has more than *limit* bytes
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        size += len(chunks[-1])
+        if limit and size > limit:
+            return None
+        if not message.get("more_body", False):
+            break
+    server.stats.count("request_wire_bytes", size)
+    server.stats.count("request_body_bytes", size)
+    return b"".join(chunks)
+
+async def respond(send, status, body, content_type="text/plain; charset=utf-8", headers=()):
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", content_type.encode("latin-1")),
+                            (b"content-length", str(len(body)).encode("latin-1"))] +
+                           [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers]})
+    await send({"type": "http.response.body", "body": body})
+
+def header(scope, name):
+    for key, value in scope["headers"]:
+        if key.decode("latin-1").lower() == name:
+            return value.decode("latin-1")
+    return None
+
+def is_form(scope):
+    content_type = header(scope, "content-type") or ""
+    return content_type.split(";")[0].strip() == "application/x-www-form-urlencoded"
+
+async def index(scope, receive, send):
+    # The same parameters as server.index(), from the query string and an
+    # url-encoded form body
+    values = parse_qs(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True)
+    timing_requested = "timing" in values or header(scope, "x-finer-timing") != None
+    if scope["method"] == "POST":
+        body = await read_body(receive, server.max_body_bytes)
+        if body == None:
+            await respond(send, 413, "Error - The request body is too large")
+            return
+        for key, value in parse_qs(body.decode("utf-8"), keep_blank_values=True).items():
+            values.setdefault(key, []).extend(value)
+    text = values.get("text", [None])[0]
+    tokenize = "pretokenized" not in values
+    depth = values.get("depth", ["ner"])[0]
+    if depth not in finer.DEPTHS:
+        await respond(send, 400, "Error - depth should be one of %s, not '%s'" % (", ".join(finer.DEPTHS), depth))
+        return
+    if text == None:
+        await respond(send, 500, "Error - You should provide the input text as 'text' GET/POST parameter")
+        return
+    large = len(text) > large_bytes
+    try:
+        admission.enter(large)
+    except Overloaded as e:
+        await respond(send, e.status, str(e), headers=[("retry-after", str(e.retry_after))])
+        return
+    server.stats.count("requests")
+    headers = []
+    try:
+        if large or timing_requested or depth == "morphology":
+            # Tagged on its own, which also keeps the Server-Timing its own;
+            # the coalescer only runs the full pipeline
+            timings = metrics.Timings() if server.metrics_enabled or timing_requested else None
+            function = server.tagger.morphology if depth == "morphology" else server.tagger
+            sentences, seconds = await asyncio.get_running_loop().run_in_executor(
+                large_executor if large else executor, timed_job, function, text, tokenize, timings)
+            admission.observe(seconds)
+            if timings != None:
+                if server.metrics_enabled:
+                    server.stats.observe(timings)
+                if timing_requested and server.server_timing(timings) != "":
+                    headers.append(("server-timing", server.server_timing(timings)))
+        else:
+            sentences = await coalescer.tag(text, tokenize)
+    finally:
+        admission.leave(large)
+    mimetype = columnar.negotiate(parse_accept_header(header(scope, "accept"), MIMEAccept))
+    if columnar.is_columnar(mimetype):
+        body = columnar.encode(columnar.document(text, sentences, depth), mimetype)
+    else:
+        body = (finer.format_morphology(sentences) if depth == "morphology" else finer.format_sentences(sentences)).encode("utf-8")
+        mimetype = "text/plain; charset=utf-8"
+    server.stats.count("response_body_bytes", len(body))
+    encoding = transport.response_encoding(header(scope, "accept-encoding"))
+    if encoding != None and len(body) >= server.compress_min_bytes:
+        if len(body) > large_bytes:
+            body = await asyncio.get_running_loop().run_in_executor(None, transport.compress, body, encoding)
+        else:
+            body = transport.compress(body, encoding)
+        headers += [("content-encoding", encoding), ("vary", "Accept-Encoding")]
+    server.stats.count("response_wire_bytes", len(body))
+    await respond(send, 200, body, mimetype, headers)
+
+class BodyReader:
+    """
+    wsgi.input for the Flask app, pulling the request body from the event
+    loop as the app reads it.
+    """
+    def __init__(self, receive, loop):
+        self.receive = receive
+        self.loop = loop
+        self.buffer = b""
+        self.more = True
+
+    def fill(self, size):
+        while self.more and (size < 0 or len(self.buffer) < size):
+            message = asyncio.run_coroutine_threadsafe(self.receive(), self.loop).result()
+            if message["type"] == "http.disconnect":
+                self.more = False
+                break
+            self.buffer += message.get("body", b"")
+            self.more = message.get("more_body", False)
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        self.fill(size)
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        while self.more and b"\n" not in self.buffer:
+            self.fill(len(self.buffer) + 1)
+        end = self.buffer.find(b"\n") + 1 or len(self.buffer)
+        if size is not None and size >= 0:
+            end = min(end, size)
+        return self.read(end)
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+def wsgi_environ(scope, body):
+    environ = {"REQUEST_METHOD": scope["method"], "SCRIPT_NAME": scope.get("root_path", ""),
+               "PATH_INFO": scope["path"], "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+               "SERVER_PROTOCOL": "HTTP/%s" % scope.get("http_version", "1.1"),
+               "wsgi.version": (1, 0), "wsgi.url_scheme": scope.get("scheme", "http"), "wsgi.input": body,
+               "wsgi.input_terminated": True, "wsgi.errors": sys.stderr,
+               "wsgi.multithread": True, "wsgi.multiprocess": False, "wsgi.run_once": False}
+    server_address = scope.get("server") or ("localhost", 80)
+    environ["SERVER_NAME"], environ["SERVER_PORT"] = server_address[0], str(server_address[1])
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for key, value in scope["headers"]:
+        name = key.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        if name in environ:
+            value = environ[name] + "," + value
+        environ[name] = value
+    return environ
+
+def run_wsgi(scope, receive, send, loop):
+    # Runs in an executor thread for the whole request, so that streamed
+    # responses are produced in the thread their request context lives in
+    def call(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    response = {}
+    def start_response(status, headers, exc_info=None):
+        response["status"] = int(status.split(" ", 1)[0])
+        response["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+
+    def start():
+        if "started" not in response:
+            response["started"] = True
+            call({"type": "http.response.start", "status": response["status"], "headers": response["headers"]})
+
+    result = server.app(wsgi_environ(scope, BodyReader(receive, loop)), start_response)
+    try:
+        for chunk in result:
+            start()
+            if chunk:
+                call({"type": "http.response.body", "body": chunk, "more_body": True})
+        start()
+        call({"type": "http.response.body", "body": b""})
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+
+async def wsgi(scope, receive, send):
+    loop = asyncio.get_running_loop()
+    if scope["path"] in ("/metrics", "/workers", "/ready"):
+        # No tagging involved, so not queued behind it
+        await loop.run_in_executor(None, run_wsgi, scope, receive, send, loop)
+        return
+    large = int(header(scope, "content-length") or large_bytes + 1) > large_bytes
+    try:
+        admission.enter(large)
+    except Overloaded as e:
+        await respond(send, e.status, str(e), headers=[("retry-after", str(e.retry_after))])
+        return
+    start = time.perf_counter()
+    try:
+        await loop.run_in_executor(large_executor if large else executor, run_wsgi, scope, receive, send, loop)
+    finally:
+        admission.leave(large)
+    admission.observe(time.perf_counter() - start)
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                executor.shutdown(wait=False)
+                large_executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+    if scope["path"] == "/" and (scope["method"] == "GET" or (scope["method"] == "POST" and is_form(scope))) and \
+            header(scope, "content-encoding") in (None, "identity"):
+        await index(scope, receive, send)
+    else:
+        await wsgi(scope, receive, send)
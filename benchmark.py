@@ -0,0 +1,505 @@
+"""
+Benchmarks for FiNER.
+
+    python benchmark.py run [--stub] [--json FILE]
+
+measures tokens per second and p50/p99 latency per document for
+omorfi_postag.TextTagger, finer.Finer and the HTTP endpoint of server.py,
+on short, medium and long synthetic documents in both tokenize and
+pretokenized modes.
+
+    python benchmark.py stages [--stub]
+
+times the pure-Python post-processing stages of finer.Finer on synthetic
+input of growing length. Each stage should take about the same time per
+token at every size; a per-token time that grows with the input means the
+stage has gone superlinear.
+
+    python benchmark.py features [--stub]
+
+times omorfi_postag.extract_features on the synthetic corpus and checks
+that its FinnPos input is byte for byte that of the original
+implementation, kept below as reference_features().
+
+    python benchmark.py tags
+
+checks tagmover.move_tags against the regex cascade it replaced on a
+synthetic corpus of nested entity tags, once more on the result as the
+second pmatch phase does, and times both. It needs neither the models nor
+--stub.
+
+    python benchmark.py incremental [--stub]
+
+edits synthetic documents one sentence at a time, tags every revision with
+incremental.IncrementalTagger, checks that the result is that of tagging
+the whole revision again and times both.
+
+    python benchmark.py corpus DIR
+
+writes the synthetic corpus the benchmarks use, and
+
+    python benchmark.py compare OLD.json NEW.json
+
+compares two result files written with --json.
+
+With --stub the hfst and finnpos modules are replaced by the stand-ins in
+benchmark_stubs/ and a placeholder data directory is used, so everything
+runs offline and without the model files. The numbers then only cover
+FiNER's own Python code.
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+WORDS = ['Sauli', 'Niinistö', 'asuu', 'Helsingissä', 'ja', 'on', 'että', 'kilpailuja', '5', 'taloa',
+         'Hän', 'osti', 'Mari', 'kisa', 'tieto', 'vuonna', '2019', 'euroa', 'Yle', 'kertoi', '.']
+
+VOCABULARY = ['ja', 'on', 'että', 'se', 'ei', 'hän', 'oli', 'myös', 'kun', 'mutta', 'vuonna', 'euroa',
+              'kertoi', 'mukaan', 'taloa', 'kilpailuja', 'hallitus', 'presidentti', 'yhtiön', 'kaupungin',
+              'asuu', 'osti', 'tieto', 'kisa', 'päivät', 'markkinat', 'suhteet', 'työntekijää', 'viime',
+              'maanantaina', 'tammikuussa', 'noin', 'prosenttia', 'miljoonaa', 'e-mail', 'yli-', '-aikaan']
+NAMES = ['Sauli', 'Niinistö', 'Helsingissä', 'Yle', 'Mari', 'Juhani', 'Nokia', 'Tampereella', 'Suomen',
+         'Sanna', 'Marin', 'EU', 'Kansa', 'Line', 'Maritta']
+NUMBERS = ['5', '12', '2019', '1,5', '300', '17.3.', '42']
+
+# Sentences per document and documents per run for each document size
+SIZES = [('short', 1, 400), ('medium', 25, 40), ('long', 1500, 2)]
+
+STUB_LEMMA_ERRORS = 'kilpailu\tkilpailu\tkilpailut\n.*s\tinen\tis\n'
+
+def synthetic_sentence(rng):
+    words = []
+    for i in range(rng.randint(4, 24)):
+        r = rng.random()
+        if r < 0.15:
+            words.append(rng.choice(NAMES))
+        elif r < 0.22:
+            words.append(rng.choice(NUMBERS))
+        else:
+            words.append(rng.choice(VOCABULARY))
+    words[0] = words[0][:1].upper() + words[0][1:]
+    return ' '.join(words) + rng.choice(['.', '.', '.', '!', '?'])
+
+def synthetic_document(rng, sentences):
+    return ' '.join(synthetic_sentence(rng) for i in range(sentences))
+
+def pretokenize(text):
+    # One token per line and an empty line after each sentence
+    lines = []
+    for token in re.findall(r'\w+(?:[-,.]\w+)*-?|[^\w\s]', text):
+        lines.append(token)
+        if token in ('.', '!', '?'):
+            lines.append('')
+    return '\n'.join(lines) + '\n'
+
+def synthetic_corpus(scale=1.0, seed=0):
+    """
+    Returns (size name, list of documents) pairs.
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for name, sentences, documents in SIZES:
+        count = max(1, int(documents * scale))
+        corpus.append((name, [synthetic_document(rng, sentences) for i in range(count)]))
+    return corpus
+
+def synthetic_postagged(sentence_count, seed=0):
+    # Sentences shaped like omorfi_postag.TextTagger output
+    rng = random.Random(seed)
+    sentences = []
+    for i in range(sentence_count):
+        sentence = []
+        for j in range(rng.randint(5, 20)):
+            word = rng.choice(WORDS)
+            sentence.append((word, word.lower() + '#' if j % 7 == 0 else word.lower(),
+                             '[POS=NOUN]|[NUM=SG]|[CASE=NOM]', '_'))
+        sentences.append(sentence)
+    return sentences
+
+def add_synthetic_tags(text):
+    # Tag some lines the way the pmatch phases do, so move_tags has work to do
+    lines = text.split('\n')
+    for i in range(0, len(lines), 5):
+        if lines[i] != '.#.':
+            lines[i] = '<EnamexPrsHum1>' + lines[i] + '</EnamexPrsHum1>'
+    return '\n'.join(lines)
+
+ENTITY_TAGS = ['EnamexPrsHum', 'EnamexLocPpl', 'EnamexOrgCrp', 'TimexTmeDat', 'NumexMsrCur', 'ExcAbbr']
+
+def add_nested_tags(lines, rng):
+    # Wraps random spans of token lines in entity tags nested up to four
+    # deep, like the proper name pmatch phases, with the depth as the last
+    # digit of the tag name
+    i = 0
+    while i < len(lines):
+        if lines[i] == '.#.' or rng.random() < 0.9:
+            i += 1
+            continue
+        end = i
+        while end + 1 < len(lines) and lines[end + 1] != '.#.' and rng.random() < 0.5:
+            end += 1
+        start = i
+        for depth in range(1, rng.randint(1, 4) + 1):
+            name = '%s%d' % (rng.choice(ENTITY_TAGS), depth)
+            lines[start] = '<%s>' % name + lines[start]
+            lines[end] = lines[end] + '</%s>' % name
+            if start < end and rng.random() < 0.5:
+                start += rng.randint(0, 1)
+                end -= rng.randint(0, end - start)
+        i = end + 1
+    return lines
+
+def bench_tags(scale, repeat):
+    tagmover = importlib.import_module('tagmover')
+    rng = random.Random(0)
+    lines = []
+    for sentence in synthetic_postagged(int(20000 * scale)):
+        lines += ['\t'.join(token) + '\t' for token in sentence] + ['.#.']
+    phase1 = '\n'.join(add_nested_tags(lines, rng))
+    cascade = lambda s: tagmover.move_tags(s, tagmover.cascade_line)
+    results = {}
+    tokens = 0
+    for phase, text in (('phase1', phase1), ('phase2', None)):
+        if text is None:
+            # The second phase tags the output of the first one again
+            text = '\n'.join(add_nested_tags(expected.rstrip('\n').split('\n'), rng))
+        tokens = text.count('\n') + 1
+        cascade_seconds, expected = time_call(cascade, text, repeat)
+        engine_seconds, actual = time_call(tagmover.move_tags, text, repeat)
+        if actual != expected:
+            for line, old, new in zip(text.split('\n'), expected.split('\n'), actual.split('\n')):
+                if old != new:
+                    raise AssertionError('move_tags mismatch for %r:\n%r\n%r' % (line, old, new))
+        results[phase] = {'lines': tokens, 'tags': text.count('<'), 'identical': True,
+                          'us_per_line': {'cascade': 1e6 * cascade_seconds / tokens,
+                                          'move_tags': 1e6 * engine_seconds / tokens}}
+    return results
+
+def print_tags(results):
+    for phase, result in results.items():
+        print('%s: %d lines, %d tags, output identical to the regex cascade' % (phase, result['lines'], result['tags']))
+        for name, us in result['us_per_line'].items():
+            print('  %-10s %8.3f us/line' % (name, us))
+
+def bench_incremental(datadir, scale, revisions=20):
+    finer = importlib.import_module('finer')
+    incremental = importlib.import_module('incremental')
+    # Without the sentence memos, so that only the incremental tagging saves work
+    nertagger = finer.Finer(datadir, memo_size=0)
+    tagger = incremental.IncrementalTagger(nertagger)
+    rng = random.Random(0)
+    full_seconds = incremental_seconds = 0.0
+    sentences = reused = 0
+    for document_id in range(max(1, int(10 * scale))):
+        paragraphs = [[synthetic_sentence(rng) for i in range(10)] for j in range(6)]
+        for revision in range(revisions):
+            if revision > 0:
+                paragraph = rng.choice(paragraphs)
+                paragraph[rng.randrange(len(paragraph))] = synthetic_sentence(rng)
+            text = '\n\n'.join(' '.join(paragraph) for paragraph in paragraphs)
+            start = time.perf_counter()
+            expected = nertagger(text)
+            full_seconds += time.perf_counter() - start
+            start = time.perf_counter()
+            actual, count = tagger(document_id, revision, text)
+            incremental_seconds += time.perf_counter() - start
+            if actual != expected:
+                raise AssertionError('incremental tagging of revision %d differs from tagging it all:\n%s' % (revision, text))
+            sentences += len(actual)
+            reused += count
+    documents = max(1, int(10 * scale)) * revisions
+    return {'revisions': documents, 'sentences': sentences, 'reused_sentences': reused, 'identical': True,
+            'ms_per_revision': {'full': 1e3 * full_seconds / documents, 'incremental': 1e3 * incremental_seconds / documents}}
+
+def print_incremental(result):
+    print('%d revisions, %d of %d sentences reused, output identical to tagging each revision in full' %
+          (result['revisions'], result['reused_sentences'], result['sentences']))
+    for name, ms in result['ms_per_revision'].items():
+        print('%-12s %8.3f ms/revision' % (name, ms))
+
+def stub_datadir():
+    datadir = tempfile.mkdtemp(prefix='finer-bench-')
+    for filename in ('omorfi_tokenize.pmatch', 'omorfi.tagtools.optcap.hfst', 'ftb.omorfi.model',
+                     'proper_tagger_ph1.pmatch', 'proper_tagger_ph2.pmatch'):
+        open(os.path.join(datadir, filename), 'w').close()
+    with open(os.path.join(datadir, 'freq_words'), 'w') as f:
+        f.write('\n'.join(VOCABULARY[:10]) + '\n')
+    with open(os.path.join(datadir, 'lemma-errors.tsv'), 'w') as f:
+        f.write(STUB_LEMMA_ERRORS)
+    return datadir
+
+def reference_features(sentences, freq_words):
+    # extract_features() as it was before it was rewritten for speed
+    def get_wf(i, sentence):
+        if i < 0 or i + 1 > len(sentence):
+            return "_#_"
+        return sentence[i].wordform[:1] or '\t'
+
+    retval = []
+    for sentence in sentences:
+        this_labeled_sentence = []
+        for i, token in enumerate(sentence):
+            wf = token.wordform
+            if '\t' in wf:
+                continue
+            features = []
+            if token.feats != '_':
+                features = token.feats.split(' ')
+            if token.lemmas is not None:
+                label_feats = ["FEAT:" + label for label, lemma in token.lemmas]
+                if len(label_feats) != 0:
+                    features += label_feats
+                else:
+                    features.append("NO_LABELS")
+            features.append('PPWORD=' + get_wf(i - 2, sentence))
+            features.append('PWORD=' + get_wf(i - 1, sentence))
+            features.append('WORD=' + wf)
+            features.append('WORD_LEN=' + str(len(wf)))
+            features.append('NWORD=' + get_wf(i + 1, sentence))
+            features.append('NNWORD=' + get_wf(i + 2, sentence))
+            features.append('PWORDPAIR=' + get_wf(i - 1, sentence) + "_" + wf)
+            features.append('NWORDPAIR=' + wf + "_" + get_wf(i + 1, sentence))
+            features.append("LC_WORD=" + wf.lower())
+            if not wf in freq_words:
+                features += ["%u-SUFFIX=%s" % (i, wf[-i:]) for i in range(1, min(11, len(wf) + 1))]
+                features += ["%u-PREFIX=%s" % (i, wf[:i]) for i in range(1, min(11, len(wf) + 1))]
+                features.append("HAS_UC" if re.match(".*([A-Z]|Å|Ä|Ö).*", wf) else None)
+                features.append("HAS_DIGIT" if re.match(".*[0-9].*", wf) else None)
+                features.append("HAS_DASH" if re.match(".*-.*", wf) else None)
+            feat_str = " ".join(filter(None, features))
+            this_labeled_sentence.append((token, "%s\t%s\t%s\t%s\t%s" % (wf, feat_str, '_', token.label_str, token.ann)))
+        retval.append(this_labeled_sentence)
+    return retval
+
+def bench_features(datadir, scale, repeat):
+    omorfi_postag = importlib.import_module('omorfi_postag')
+    postagger = omorfi_postag.TextTagger(datadir)
+    sentences = []
+    for size, documents in synthetic_corpus(scale):
+        for document in documents:
+            sentences += postagger.analyse(document)
+    # Word forms the tokenizer is unlikely to produce but the features must survive
+    sentences.append([omorfi_postag.Token(wordform) for wordform in
+                      ['', 'a\tb', 'Line\nBreak', 'x\nÄ-1', 'kilpailuja', 'Å', '-', 'ja']])
+    tokens = sum(len(sentence) for sentence in sentences)
+    old_seconds, old = time_call(lambda s: reference_features(s, postagger.freq_words), sentences, repeat)
+    cold_seconds, new = time_call(lambda s: omorfi_postag.extract_features(s, postagger.freq_words), sentences, repeat)
+    # The first call fills the word form cache the timed ones use
+    cached = lambda s: omorfi_postag.extract_features(s, postagger.freq_words, postagger.feature_cache)
+    cached(sentences)
+    warm_seconds, new_warm = time_call(cached, sentences, repeat)
+    for expected, actual in ((old, new), (old, new_warm)):
+        for old_sentence, new_sentence in zip(expected, actual):
+            for (old_token, old_line), (new_token, new_line) in zip(old_sentence, new_sentence):
+                if old_line != new_line:
+                    raise AssertionError('feature mismatch for %r:\n%s\n%s' % (old_token.wordform, old_line, new_line))
+        if [len(s) for s in expected] != [len(s) for s in actual]:
+            raise AssertionError('feature mismatch: different token counts')
+    return {'tokens': tokens, 'identical': True,
+            'us_per_token': {'reference': 1e6 * old_seconds / tokens, 'extract_features': 1e6 * cold_seconds / tokens,
+                             'extract_features_cached': 1e6 * warm_seconds / tokens}}
+
+def print_features(result):
+    print('%d tokens, output identical to the reference implementation' % result['tokens'])
+    for name, us in result['us_per_token'].items():
+        print('%-24s %8.3f us/token' % (name, us))
+
+def setup(args):
+    """
+    Points the imports at the stubs if asked to, returns the data directory.
+    """
+    if args.stub:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_stubs'))
+        return stub_datadir()
+    return args.datadir
+
+def time_call(function, arg, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def count_tokens(sentences):
+    return sum(len(sentence) for sentence in sentences)
+
+def bench_target(name, function, documents, size, mode):
+    latencies = []
+    tokens = 0
+    start = time.perf_counter()
+    for document in documents:
+        call_start = time.perf_counter()
+        tokens += function(document)
+        latencies.append(time.perf_counter() - call_start)
+    seconds = time.perf_counter() - start
+    return {'target': name, 'size': size, 'mode': mode, 'documents': len(documents), 'tokens': tokens,
+            'seconds': seconds, 'tokens_per_second': tokens / seconds if seconds else 0.0,
+            'p50_ms': 1000 * percentile(latencies, 0.5), 'p99_ms': 1000 * percentile(latencies, 0.99)}
+
+def bench_run(datadir, scale, url=None):
+    finer = importlib.import_module('finer')
+    nertagger = finer.Finer(datadir)
+    if url is None:
+        os.environ['FINER_DATADIR'] = datadir
+        client = importlib.import_module('server').app.test_client()
+
+    def http(document, tokenize):
+        data = {'text': document}
+        if not tokenize:
+            data['pretokenized'] = '1'
+        if url is None:
+            body = client.post('/', data=data).get_data(as_text=True)
+        else:
+            from urllib.parse import urlencode
+            from urllib.request import urlopen
+            body = urlopen(url, urlencode(data).encode('utf-8')).read().decode('utf-8')
+        return sum(1 for line in body.split('\n') if line != '')
+
+    targets = [('TextTagger', lambda document, tokenize: count_tokens(nertagger.postagger(document, tokenize))),
+               ('Finer', lambda document, tokenize: count_tokens(nertagger(document, tokenize))),
+               ('HTTP', http)]
+    results = []
+    for size, documents in synthetic_corpus(scale):
+        for mode, tokenize in (('tokenize', True), ('pretokenized', False)):
+            inputs = documents if tokenize else [pretokenize(document) for document in documents]
+            for name, function in targets:
+                call = lambda document: function(document, tokenize)
+                # Warm up caches and lazily loaded parts before timing
+                call(inputs[0])
+                results.append(bench_target(name, call, inputs, size, mode))
+    return results
+
+def print_run(results):
+    print('%-11s %-7s %-13s %6s %9s %12s %10s %10s' % ('target', 'size', 'mode', 'docs', 'tokens', 'tokens/s', 'p50 ms', 'p99 ms'))
+    for r in results:
+        print('%-11s %-7s %-13s %6d %9d %12.0f %10.3f %10.3f' % (r['target'], r['size'], r['mode'], r['documents'],
+                                                                r['tokens'], r['tokens_per_second'], r['p50_ms'], r['p99_ms']))
+
+def bench_stages(datadir, sizes, repeat):
+    finer = importlib.import_module('finer')
+    nertagger = finer.Finer(datadir)
+    results = []
+    for size in sizes:
+        sentences = synthetic_postagged(size)
+        tokens = sum(len(sentence) for sentence in sentences)
+        timings = {}
+        timings['format_for_nertag'], data = time_call(nertagger.format_for_nertag, sentences, repeat)
+        timings['normalize_lemmas'], data = time_call(nertagger.normalize_lemmas, data, repeat)
+        timings['prefilt_tags'], data = time_call(nertagger.prefilt_tags, data, repeat)
+        timings['add_boundaries'], data = time_call(nertagger.add_boundaries, data, repeat)
+        timings['move_tags'], data = time_call(nertagger.move_tags, add_synthetic_tags(data), repeat)
+        timings['remove_exc'], data = time_call(nertagger.remove_exc, data, repeat)
+        tagged = [[(token[0], '') for token in sentence] for sentence in sentences]
+        timings['format_sentences'], data = time_call(finer.format_sentences, tagged, repeat)
+        results.append({'sentences': size, 'tokens': tokens,
+                         'us_per_token': dict((stage, 1e6 * seconds / tokens) for stage, seconds in timings.items())})
+    return results
+
+def print_stages(results):
+    stages = list(results[0]['us_per_token'])
+    print('%10s  ' % 'tokens' + '  '.join('%17s' % stage for stage in stages))
+    for result in results:
+        print('%10d  ' % result['tokens'] + '  '.join('%17.3f' % result['us_per_token'][stage] for stage in stages))
+    # Per-token time at the largest size relative to the smallest; about 1.0 when linear
+    print('%10s  ' % 'growth' + '  '.join('%17.2f' % (results[-1]['us_per_token'][stage] / results[0]['us_per_token'][stage])
+                                         for stage in stages))
+
+def environment(args):
+    try:
+        revision = subprocess.check_output(['git', 'describe', '--always', '--dirty'], stderr=subprocess.DEVNULL,
+                                           cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {'revision': revision, 'python': platform.python_version(), 'stub': args.stub,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def compare(old_file, new_file):
+    old = json.load(open(old_file))
+    new = json.load(open(new_file))
+    print('%s -> %s' % (old['environment'].get('revision'), new['environment'].get('revision')))
+    if 'run' in old and 'run' in new:
+        old_rows = dict(((r['target'], r['size'], r['mode']), r) for r in old['run'])
+        print('%-11s %-7s %-13s %12s %12s %7s %9s %9s' % ('target', 'size', 'mode', 'old tok/s', 'new tok/s', 'ratio',
+                                                          'old p99', 'new p99'))
+        for r in new['run']:
+            o = old_rows.get((r['target'], r['size'], r['mode']))
+            if o is None:
+                continue
+            ratio = r['tokens_per_second'] / o['tokens_per_second'] if o['tokens_per_second'] else 0.0
+            print('%-11s %-7s %-13s %12.0f %12.0f %7.2f %9.3f %9.3f' % (r['target'], r['size'], r['mode'],
+                                                                       o['tokens_per_second'], r['tokens_per_second'],
+                                                                       ratio, o['p99_ms'], r['p99_ms']))
+    if 'stages' in old and 'stages' in new:
+        for o, r in zip(old['stages'], new['stages']):
+            print('%d tokens: ' % r['tokens'] + ', '.join('%s %.2fx' % (stage, o['us_per_token'][stage] / us)
+                                                       for stage, us in r['us_per_token'].items()
+                                                       if stage in o['us_per_token'] and us))
+
+def main():
+    parser = argparse.ArgumentParser(description='FiNER benchmarks')
+    parser.add_argument('benchmark', choices=['run', 'stages', 'features', 'tags', 'incremental', 'corpus', 'compare'])
+    parser.add_argument('paths', nargs='*', help='output directory for corpus, result files for compare')
+    parser.add_argument('--datadir', default='/app/finnish-tagtools/tag')
+    parser.add_argument('--stub', action='store_true', help='use the stand-in hfst and finnpos modules')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier for the number of documents')
+    parser.add_argument('--url', help='benchmark a running server at this URL instead of one in-process')
+    parser.add_argument('--sizes', default='250,1000,4000,16000', help='comma-separated sentence counts for stages')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='also write the results as JSON to this file')
+    args = parser.parse_args()
+
+    if args.benchmark == 'compare':
+        compare(*args.paths)
+        return
+    if args.benchmark == 'corpus':
+        directory = args.paths[0]
+        os.makedirs(directory, exist_ok=True)
+        for size, documents in synthetic_corpus(args.scale):
+            with open(os.path.join(directory, size + '.txt'), 'w') as f:
+                f.write('\n\n'.join(documents) + '\n')
+            with open(os.path.join(directory, size + '.pretokenized.txt'), 'w') as f:
+                f.write('\n'.join(pretokenize(document) for document in documents))
+        return
+
+    output = {'environment': environment(args)}
+    if args.benchmark == 'tags':
+        output['tags'] = bench_tags(args.scale, args.repeat)
+        print_tags(output['tags'])
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(output, f, indent=2)
+        return
+    datadir = setup(args)
+    if args.benchmark == 'run':
+        output['run'] = bench_run(datadir, args.scale, args.url)
+        print_run(output['run'])
+    elif args.benchmark == 'features':
+        output['features'] = bench_features(datadir, args.scale, args.repeat)
+        print_features(output['features'])
+    elif args.benchmark == 'incremental':
+        output['incremental'] = bench_incremental(datadir, args.scale)
+        print_incremental(output['incremental'])
+    else:
+        sizes = [int(size) for size in args.sizes.split(',')]
+        output['stages'] = bench_stages(datadir, sizes, args.repeat)
+        print_stages(output['stages'])
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(output, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+"""
+Stand-in for the finnpos module, so the benchmarks can run without FinnPos
+or its model. It labels each token with its last omorfi analysis.
+"""
+
+class Labeler:
+    def load_model(self, filename):
+        self.filename = filename
+
+    def label(self, text):
+        lines = []
+        for line in text.split('\n'):
+            if line == '':
+                # Sentences are separated by empty lines
+                lines.append(line)
+                continue
+            wf, feats, lemma, label, ann = line.split('\t')
+            labels = [feat[len('OMORFI_FEAT:'):] for feat in feats.split(' ') if feat.startswith('OMORFI_FEAT:')]
+            label = labels[-1] if labels else '[POS=NOUN]|[NUM=SG]|[CASE=NOM]'
+            lines.append('\t'.join([wf, feats, wf.lower(), label, ann]))
+        return '\n'.join(lines)
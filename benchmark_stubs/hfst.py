@@ -0,0 +1,79 @@
+"""
+Stand-in for the parts of the hfst module FiNER uses, so the benchmarks can
+run without HFST or the model files. The analyses and tags it produces are
+made up; only their shape matches the real ones.
+"""
+import re
+
+TOKEN_RE = re.compile(r'\w+|[^\w\s]')
+
+def analyses(token):
+    if token in ('.', '!', '?'):
+        return ['[WORD_ID=%s][POS=PUNCTUATION]' % token]
+    if not token[0].isalnum():
+        return ['[WORD_ID=%s][POS=PUNCTUATION]' % token]
+    if token[0].isdigit():
+        return ['[WORD_ID=%s][POS=NUMERAL][NUM=SG][CASE=NOM]' % token]
+    retval = ['[WORD_ID=%s][POS=NOUN][NUM=SG][CASE=NOM]' % token.lower()]
+    if token[0].isupper():
+        retval.append('[WORD_ID=%s][POS=NOUN][PROPER=PROPER][NUM=SG][CASE=NOM]' % token)
+    if token.endswith('n'):
+        retval.append('[WORD_ID=%s][POS=NOUN][NUM=SG][CASE=GEN]' % token[:-1].lower())
+    if token.endswith('ssa') or token.endswith('ssä'):
+        retval.append('[WORD_ID=%s#talo][POS=NOUN][NUM=SG][CASE=INE]' % token[:-3].lower())
+    return retval
+
+class Location:
+    def __init__(self, input, output, tag=''):
+        self.input = input
+        self.output = output
+        self.tag = tag
+
+class Transducer:
+    def lookup(self, token):
+        return [(analysis, 0.0) for analysis in analyses(token)]
+
+class HfstInputStream:
+    def __init__(self, filename):
+        self.filename = filename
+
+    def read(self):
+        return Transducer()
+
+    def close(self):
+        pass
+
+class PmatchContainer:
+    def __init__(self, filename):
+        self.filename = filename
+
+    def locate(self, text):
+        retval = []
+        for match in TOKEN_RE.finditer(text):
+            token = match.group()
+            tag = '<Boundary=Sentence>' if token in ('.', '!', '?') else ''
+            retval.append(tuple(Location(token, analysis, tag) for analysis in analyses(token)))
+        return retval
+
+    def match(self, text):
+        # Tag runs of capitalized tokens in the first phase and numbers in
+        # the second, in the way the real pmatch taggers mark entities
+        lines = text.split('\n')
+        if 'ph1' in self.filename:
+            start = None
+            for i, line in enumerate(lines + ['']):
+                capitalized = line[:1].isupper()
+                if capitalized and start is None:
+                    start = i
+                elif not capitalized and start is not None:
+                    if i - start == 1:
+                        lines[start] = '<EnamexLocXxx>' + lines[start] + '</EnamexLocXxx>'
+                    else:
+                        lines[start] = '<EnamexPrsHum>' + lines[start]
+                        lines[i - 1] = lines[i - 1] + '</EnamexPrsHum>'
+                    start = None
+        elif 'ph2' in self.filename:
+            for i, line in enumerate(lines):
+                if line[:1].isdigit():
+                    lines[i] = '<NumexMsrXxx>' + line + '</NumexMsrXxx>'
+        return '\n'.join(lines)
@@ -0,0 +1,106 @@
+"""
+Precompiled data for Finer and TextTagger, derived from the files of a
+data directory and packed into one file that is memory-mapped read-only,
+so that all processes using it on a host share its pages.
+
+    python bundle.py DATADIR [BUNDLE [lines|words]]
+
+compiles DATADIR/finer.bundle or BUNDLE, with the frequent words matched
+as given (see freqwords.py). The bundle records the sha256 of
+each source file and is rejected when opened against different ones.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import freqwords
+import lemmarules
+
+MAGIC = b'FINERBUNDLE\0'
+VERSION = 2
+SOURCES = ('freq_words', 'lemma-errors.tsv')
+
+class BundleMismatch(ValueError):
+    pass
+
+def file_digest(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def compile_bundle(datadir, filename=None, freq_words_match='lines'):
+    """
+    Writes the bundle for *datadir* to *filename*, by default
+    finer.bundle in *datadir*, and returns its path.
+    """
+    if filename is None:
+        filename = os.path.join(datadir, 'finer.bundle')
+    freq_words = freqwords.load(os.path.join(datadir, 'freq_words'), freq_words_match)
+    offsets, words, table = freq_words.buffers()
+    sections = [('freq_offsets', offsets), ('freq_table', table), ('freq_words', words),
+                ('lemma_rules', json.dumps(lemmarules.read_lemma_errors(os.path.join(datadir, 'lemma-errors.tsv')),
+                                           ensure_ascii=False).encode('utf-8'))]
+    header = {'version': VERSION, 'byteorder': sys.byteorder, 'freq_count': len(freq_words), 'freq_match': freq_words_match,
+              'sources': dict((source, file_digest(os.path.join(datadir, source))) for source in SOURCES),
+              'sections': {}}
+    # Section offsets are relative to the end of the header
+    position = 0
+    for name, data in sections:
+        header['sections'][name] = [position, len(data)]
+        position += len(data) + (-len(data) % 8)
+    header_bytes = json.dumps(header).encode('utf-8')
+    header_bytes += b' ' * (-(len(MAGIC) + 4 + len(header_bytes)) % 8)
+    with open(filename + '.tmp', 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header_bytes)) + header_bytes)
+        for name, data in sections:
+            f.write(data + b'\0' * (-len(data) % 8))
+    os.replace(filename + '.tmp', filename)
+    return filename
+
+class Bundle:
+    """
+    An opened bundle. With *datadir*, the source files there must be the
+    ones the bundle was compiled from, or BundleMismatch is raised.
+    """
+    def __init__(self, filename, datadir=None):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mmap[:len(MAGIC)] != MAGIC:
+            raise BundleMismatch('%s is not a FiNER bundle' % filename)
+        header_length = struct.unpack('<I', self.mmap[len(MAGIC):len(MAGIC) + 4])[0]
+        start = len(MAGIC) + 4
+        self.header = json.loads(self.mmap[start:start + header_length].decode('utf-8'))
+        if self.header.get('version') != VERSION or self.header.get('byteorder') != sys.byteorder:
+            raise BundleMismatch('%s was compiled for another version or byte order; compile it again' % filename)
+        self.data_start = start + header_length
+        if datadir is not None:
+            self.verify(datadir)
+
+    def verify(self, datadir):
+        for source, digest in sorted(self.header['sources'].items()):
+            if file_digest(os.path.join(datadir, source)) != digest:
+                raise BundleMismatch('%s was compiled from a different %s than the one in %s' % (self.filename, source, datadir))
+
+    def section_start(self, name):
+        return self.data_start + self.header['sections'][name][0]
+
+    def section(self, name):
+        start = self.section_start(name)
+        return memoryview(self.mmap)[start:start + self.header['sections'][name][1]]
+
+    def freq_words(self, match='lines'):
+        if match != self.header['freq_match']:
+            raise BundleMismatch("%s matches frequent words as %s, not %s" % (self.filename, self.header['freq_match'], match))
+        return freqwords.FreqWords(self.section('freq_offsets').cast('I'), self.mmap, self.section_start('freq_words'),
+                                   self.section('freq_table').cast('I'), match)
+
+    def lemma_rules(self):
+        return [tuple(rule) for rule in json.loads(bytes(self.section('lemma_rules')).decode('utf-8'))]
+
+if __name__ == '__main__':
+    print(compile_bundle(*sys.argv[1:4]))
@@ -0,0 +1,71 @@
+import threading
+from collections import OrderedDict
+
+class LRUCache:
+    """
+    A size-bounded least-recently-used mapping that counts hits, misses and
+    evictions. A *maxsize* of 0 disables caching altogether. With *sizeof*,
+    a function giving the size of a value in bytes, the total size is kept
+    too and bounded by *maxbytes* unless that is 0.
+    """
+    def __init__(self, maxsize=65536, sizeof=None, maxbytes=0):
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.maxbytes = maxbytes
+        self.bytes = 0
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            if self.sizeof is not None:
+                if key in self.data:
+                    self.bytes -= self.sizeof(self.data[key])
+                self.bytes += self.sizeof(value)
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize or (self.maxbytes > 0 and self.bytes > self.maxbytes and self.data):
+                key, value = self.data.popitem(last=False)
+                if self.sizeof is not None:
+                    self.bytes -= self.sizeof(value)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self.lock:
+            if key not in self.data:
+                return default
+            value = self.data.pop(key)
+            if self.sizeof is not None:
+                self.bytes -= self.sizeof(value)
+            return value
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.bytes = 0
+
+    def stats(self):
+        retval = {'size': len(self.data), 'maxsize': self.maxsize, 'hits': self.hits,
+                  'misses': self.misses, 'evictions': self.evictions}
+        if self.sizeof is not None:
+            retval['bytes'] = self.bytes
+        return retval
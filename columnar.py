@@ -0,0 +1,118 @@
+"""
+A compact response format for clients that want entity spans rather than
+word-tag TSV. A tagged document becomes parallel arrays: the tokens, their
+character offsets in the input text (code points, -1 where a token can't be
+found there, as when the tokenizer has changed it), the number of tokens in
+each sentence and the entities, each with its tag name, its first token and
+the token after its last one, and its character offsets. With
+depth=morphology, the lemmas, labels and annotations of the tokens are
+sent instead of the entities.
+
+It is encoded with msgpack if that is installed, or as JSON, and chosen
+with the Accept header (see negotiate()).
+"""
+import json
+import re
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+TEXT = 'text/plain'
+COLUMNAR_JSON = 'application/vnd.finer.columnar+json'
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+
+entity_tag_re = re.compile(r'<(/?)((?:Enamex|Timex|Numex)[^<>/]*)(/?)>')
+
+def token_offsets(text, words):
+    """
+    The (start, end) character offsets of *words* in *text*, looking for
+    each one after the previous one with only whitespace in between, or
+    after words not found, in place of them, no more text than they had.
+    """
+    starts = []
+    ends = []
+    position = 0
+    missing = 0
+    for word in words:
+        # Whitespace runs aside, a word is never far from the last one found
+        start = text.find(word, position, position + missing + len(word) + 1024)
+        if start == -1 or len(''.join(text[position:start].split())) > missing:
+            starts.append(-1)
+            ends.append(-1)
+            missing += len(word)
+            continue
+        position = start + len(word)
+        missing = 0
+        starts.append(start)
+        ends.append(position)
+    return starts, ends
+
+def entity_spans(tags):
+    """
+    (name, first token, token after the last one) for the entity tags in the
+    tag column *tags* of a document, in order of their first token.
+    """
+    spans = []
+    opened = []
+    for i, tag in enumerate(tags):
+        if '<' not in tag:
+            continue
+        for closing, name, empty in entity_tag_re.findall(tag):
+            if empty:
+                spans.append((i, i + 1, name))
+            elif not closing:
+                opened.append((i, name))
+            else:
+                for j in range(len(opened) - 1, -1, -1):
+                    if opened[j][1] == name:
+                        spans.append((opened[j][0], i + 1, name))
+                        del opened[j]
+                        break
+    spans.sort(key=lambda span: span[:2])
+    return [(name, first, end) for first, end, name in spans]
+
+def document(text, sentences, depth='ner'):
+    """
+    The columnar form of the tagged *sentences* of *text*, as Finer or
+    Finer.morphology() returns them.
+    """
+    words = [word[0] for sentence in sentences for word in sentence]
+    starts, ends = token_offsets(text, words)
+    result = {'tokens': words, 'starts': starts, 'ends': ends,
+              'sentences': [len(sentence) for sentence in sentences]}
+    if depth == 'morphology':
+        result['lemmas'] = [word[1] for sentence in sentences for word in sentence]
+        result['labels'] = [word[2] for sentence in sentences for word in sentence]
+        result['annotations'] = [word[3] for sentence in sentences for word in sentence]
+        return result
+    spans = entity_spans([word[1] for sentence in sentences for word in sentence])
+    result['entities'] = {
+        'types': [name for name, first, end in spans],
+        'first': [first for name, first, end in spans],
+        'end': [end for name, first, end in spans],
+        'starts': [starts[first] for name, first, end in spans],
+        'ends': [ends[end - 1] for name, first, end in spans]}
+    return result
+
+def offered(default=TEXT):
+    types = [default, COLUMNAR_JSON]
+    if msgpack is not None:
+        types.extend(MSGPACK_TYPES)
+    return types
+
+def negotiate(accept, default=TEXT):
+    """
+    The response type to use for the werkzeug MIMEAccept *accept*:
+    *default* unless the client asks for the columnar format.
+    """
+    return accept.best_match(offered(default), default=default)
+
+def is_columnar(mimetype):
+    return mimetype == COLUMNAR_JSON or mimetype in MSGPACK_TYPES
+
+def encode(value, mimetype):
+    if mimetype in MSGPACK_TYPES:
+        return msgpack.packb(value, use_bin_type=True)
+    return json.dumps(value, ensure_ascii=False).encode('utf-8')
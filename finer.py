@@ -1,22 +1,148 @@
+import logging
 import os
 import re
 import hfst
 import omorfi_postag
+import prefilter as entity_prefilter
+import bundle
+import lemmarules
+import loading
+import tagmover
+from collections import OrderedDict
+from cache import LRUCache
+from metrics import timed
+
+log = logging.getLogger('finer')
+
+# How far the pipeline goes: up to the POS tagger's morphological labels,
+# or through the NER stages
+DEPTHS = ('morphology', 'ner')
+
+# Characters of an unfinished sentence that stream_blocks() carries over
+# before it gives up waiting for the sentence to end
+MAX_SENTENCE_SIZE = 262144
+
+def stream_blocks(tag_block, pieces, tokenize=True, block_size=65536, timings=None, max_sentence_size=MAX_SENTENCE_SIZE):
+    """
+    Yields the tagged sentences of text given as an iterable of pieces,
+    calling *tag_block* (eg. Finer.tag_block) on about *block_size*
+    characters at a time. A sentence left unfinished at the end of a block
+    is carried over to the next one, unless it already has more than
+    *max_sentence_size* characters: then it is cut where the block ends and
+    the split is logged, so that text without sentence boundaries can't
+    make the carried over text grow without bound.
+    """
+    rest = ''
+    for block in omorfi_postag.text_blocks(pieces, block_size, not tokenize, max_sentence_size):
+        text = rest + block
+        final = len(rest) > max_sentence_size
+        if final:
+            log.warning('Cutting a sentence of more than %d characters at the end of a block', len(rest))
+        sentences, rest = tag_block(text, tokenize, final, timings)
+        for sentence in sentences:
+            yield sentence
+    if rest != '':
+        sentences, rest = tag_block(rest, tokenize, True, timings)
+        for sentence in sentences:
+            yield sentence
+
+def split_documents(sentences, documents):
+    """
+    Splits a list of sentences back into runs of as many sentences as each
+    of *documents* has.
+    """
+    retval = []
+    start = 0
+    for document in documents:
+        retval.append(sentences[start:start + len(document)])
+        start += len(document)
+    return retval
+
+def split_sentences(sentences, count):
+    """
+    Splits a list of sentences into at most *count* runs of consecutive
+    sentences with about the same number of tokens in each.
+    """
+    total = sum(len(sentence) for sentence in sentences)
+    runs = []
+    run = []
+    size = 0
+    for sentence in sentences:
+        run.append(sentence)
+        size += len(sentence)
+        if size * count >= total * (len(runs) + 1) and len(runs) < count - 1:
+            runs.append(run)
+            run = []
+    if len(run) != 0 or len(runs) == 0:
+        runs.append(run)
+    return runs
+
+def format_sentences(sentences):
+    lines = []
+    for sentence in sentences:
+        for word in sentence:
+            lines.append(word[0] + '\t' + word[1] + '\n')
+        lines.append('\n')
+    return ''.join(lines)
+
+def format_morphology(sentences):
+    # Word form, lemma, label and proper tag annotation of each token
+    lines = []
+    for sentence in sentences:
+        for word in sentence:
+            lines.append('\t'.join(word) + '\n')
+        lines.append('\n')
+    return ''.join(lines)
+
+def count_input(timings, texts):
+    if timings is not None:
+        timings.count('documents', len(texts))
+        timings.count('bytes_in', sum(len(text.encode('utf-8')) for text in texts))
 
 class Finer:
     """
     Do Finnish named entity recognition using FinnPos (a dependency), FiNER
     and HFST.
     """
-    def __init__(self, datadir):
+    def __init__(self, datadir, cache_size=65536, memo_size=4096, lazy=(), wait=True, bundle_file=None,
+                 freq_words_match='lines', prefilter=False, label_batch_size=64, label_thread=False):
         """
         The compulsory argument *datadir* should be a path to eg. the /tag/
-        directory of a finnish-tagtools package.
+        directory of a finnish-tagtools package. *cache_size* bounds the
+        morphological analysis cache of the POS tagger. *memo_size* bounds
+        the number of tagged sentences remembered between calls, by both
+        the POS tagger and the NER stages; 0 turns that off.
+
+        The models are loaded concurrently, except those named in *lazy*
+        (see status() for the names), which are loaded when first used; eg.
+        pretokenized text never needs the tokenizer. Unless *wait* is set,
+        loading goes on in the background after this returns.
+
+        *bundle_file* names a bundle compiled from *datadir* with bundle.py,
+        to take the frequent words and lemma rules from. A bundle compiled
+        from other files raises bundle.BundleMismatch. *freq_words_match*,
+        *label_batch_size* and *label_thread* are passed on to the
+        TextTagger.
+
+        With *prefilter*, sentences that prefilter.EntityPrefilter finds no
+        possible entities in skip the pmatch phases, and with
+        prefilter='initial' also those with no capital other than an
+        ordinary word starting the sentence. Check that it holds for the
+        rules in *datadir* with "python prefilter.py check" and "validate"
+        first.
         """
         self.datadir = datadir
-        self.postagger = omorfi_postag.TextTagger(self.datadir)
-        self.p1_tagger = hfst.PmatchContainer(self.datadir + "/proper_tagger_ph1.pmatch")
-        self.p2_tagger = hfst.PmatchContainer(self.datadir + "/proper_tagger_ph2.pmatch")
+        self.bundle = None if bundle_file is None else bundle.Bundle(bundle_file, datadir)
+        self.postagger = omorfi_postag.TextTagger(self.datadir, cache_size=cache_size, memo_size=memo_size,
+                                                  lazy=lazy, wait=False, bundle=self.bundle,
+                                                  freq_words_match=freq_words_match,
+                                                  label_batch_size=label_batch_size, label_thread=label_thread)
+        self.artifacts = OrderedDict(self.postagger.artifacts)
+        for name in ('proper_tagger_ph1', 'proper_tagger_ph2'):
+            self.artifacts[name] = loading.Artifact(name, self.datadir + "/" + name + ".pmatch", hfst.PmatchContainer)
+        loading.start_all(self.artifacts, lazy)
+        if wait:
+            self.wait()
 
         self.subs = [
             ("ntelu#", "nnella#"), 
@@ -98,23 +224,21 @@ class Finer:
             ("tieto#", "tiedot#"),
         ]
         
-        self.regex_filename = '/app/finnish-tagtools/tag/lemma-errors.tsv'
-        self.regexes = []
-        for line in open(self.regex_filename, 'r'):
-            w_patt, l_patt, l_new = line.strip().split('\t')
-            self.regexes.append((re.compile(w_patt + '.*'), re.compile(l_patt+'\\Z'), l_new))
-
-        self.open_and_close_tag_re = re.compile(r'<((Enamex|Timex|Numex|Exc)[^>]+)>(.+)</\1>')
-        self.open_and_close_tag_re_replacement = r'\3<\1/>'
-        self.open_tag_re = re.compile(r'^(<(Enamex|Timex|Numex|Exc)[^>]+>)([^\t].*)$')
-        self.open_tag_re_replacement = r'\3\1'
-        self.nested_tag_4 = re.compile(r'(</?(Enamex|Timex|Numex)[^>]+4/?>)([^\t]*\t[^\t]*\t[^\t]*\t)')
-        self.nested_tag_3 = re.compile(r'(</?(Enamex|Timex|Numex)[^>]+3/?>)([^\t]*\t[^\t]*\t)')
-        self.nested_tag_2 = re.compile(r'(</?(Enamex|Timex|Numex)[^>]+2/?>)([^\t]*\t)')
-        self.nested_tag_1 = re.compile(r'\t+(<(Enamex|Timex|Numex)[^>]+1>)')
-        self.nested_tag_1_replacement = r'\t\1'
-        self.nested_tags = re.compile(r'(</?(Enamex|Timex|Numex)[^>1234]+)[1234](/?>)')
-        self.nested_tags_replacement = r'\1\3'
+        self.regex_filename = os.path.join(self.datadir, 'lemma-errors.tsv')
+        self.suffix_subs = lemmarules.SuffixSubstitutions(self.subs)
+        if self.bundle is None:
+            self.lemma_regexes = lemmarules.LemmaRegexes(lemmarules.read_lemma_errors(self.regex_filename))
+        else:
+            self.lemma_regexes = lemmarules.LemmaRegexes(self.bundle.lemma_rules())
+        # Corrected lemmas by (word form, lemma)
+        self.lemma_cache = LRUCache(cache_size)
+        self.sentence_memo = LRUCache(memo_size)
+        self.prefilter = entity_prefilter.EntityPrefilter(entity_prefilter.read_triggers(datadir),
+                                                         prefilter == 'initial') if prefilter else None
+        self.settings = OrderedDict([('bundle_file', bundle_file), ('freq_words_match', freq_words_match),
+                                     ('prefilter', prefilter), ('label_batch_size', label_batch_size),
+                                     ('label_thread', label_thread)])
+
         self.exc_tag_re = re.compile(r'</?Exc[^>]+>')
 
     def format_for_nertag(self, sentences):
@@ -130,22 +254,8 @@ class Finer:
         # - Replace hashes marking morpheme boundaries (#) with hyphens in lemma forms whenever necessary
         # ( Otherwise remove hashes in lemma forms )
 
-        def inf2prefix(wform, lemma_new):
-            for (w_end, l_end) in self.subs:
-                if wform.lower().startswith(lemma_new.replace(l_end, w_end[:-1])):
-                    lemma_new = lemma_new.replace(l_end, w_end)
-                    break
-            return lemma_new
-
-        def fix_nouns(wform, lemma_new):
-            for (w_regex, l_regex, l_new) in self.regexes:
-                if re.search(l_regex, lemma_new) != None:
-                    if re.fullmatch(w_regex, wform.lower()):
-                        lemma_new = re.sub(l_regex, l_new, lemma_new)
-            return lemma_new
-
-        def correct(token):
-            wform, lemma, morph, semtag = token
+        def correct_lemma(wform, lemma):
+            wform_lower = wform.lower()
             lemma_new = ''
             lemma = lemma.replace('#-', '#')
             lemma = lemma.replace('#', '#|')
@@ -154,27 +264,36 @@ class Finer:
             for m in lemma.split('|'):
                 lemma_new = lemma_new + m
 
-                if wform.lower().startswith( lemma_new[:-1] ) == False:
-                    lemma_new = inf2prefix(wform, lemma_new)
+                if wform_lower.startswith( lemma_new[:-1] ) == False:
+                    lemma_new = self.suffix_subs(wform_lower, lemma_new)
 
-                if wform.lower().startswith(lemma_new.replace('-#', '-')):
+                if wform_lower.startswith(lemma_new.replace('-#', '-')):
                     lemma_new = lemma_new.replace('-#', '-')
 
-                if wform.lower().startswith(lemma_new.replace('#', '-')):
+                if wform_lower.startswith(lemma_new.replace('#', '-')):
                     lemma_new = lemma_new.replace('#', '-')
 
-                if wform.lower().startswith(lemma_new.replace('-#', '')):
+                if wform_lower.startswith(lemma_new.replace('-#', '')):
                     lemma_new = lemma_new.replace('-#', '')
             
                 lemma_new = lemma_new.rstrip('#')
-            lemma_new = fix_nouns(wform, lemma_new)
+            lemma_new = self.lemma_regexes(wform_lower, lemma_new)
 
             # Restore hyphens removed by OMorFi and FinnPOS
             if '-' in wform and '-' not in lemma_new:
-                pfx = wform.lower().split('-')[0]
+                pfx = wform_lower.split('-')[0]
                 if lemma_new.startswith(pfx):
                     lemma_new = pfx + '-' + lemma_new[len(pfx):]
     
+            return lemma_new
+
+        def correct(token):
+            wform, lemma, morph, semtag = token
+            key = (wform, lemma)
+            lemma_new = self.lemma_cache.get(key)
+            if lemma_new is None:
+                lemma_new = correct_lemma(wform, lemma)
+                self.lemma_cache.put(key, lemma_new)
             return((wform, lemma_new, morph, semtag))
     
         return [[correct(token) for token in sentence] for sentence in sentences]
@@ -230,61 +349,134 @@ class Finer:
         return [[handle_token(token) for token in sentence] for sentence in sentences]
 
     def add_boundaries(self, sentences):
-        retval = ''
+        lines = []
         for sentence in sentences:
             for token in sentence:
-                retval += '\t'.join(token) + '\t\n'
-            retval += '.#.\n'
-        return retval[:-4]
+                lines.append('\t'.join(token) + '\t\n')
+            lines.append('.#.\n')
+        # No boundary after the last sentence
+        return ''.join(lines[:-1])
 
     def proper_tag1(self, s):
-        return self.p1_tagger.match(s)
+        return self.artifacts['proper_tagger_ph1'].get().match(s)
 
     def proper_tag2(self, s):
-        return self.p2_tagger.match(s)
+        return self.artifacts['proper_tagger_ph2'].get().match(s)
 
     def move_tags(self, s):
         # Move start tags from beginning of each line to their respective columns
         # Tags with names ending in 1, 2, 3, or 4 are moved to columns 5, 6, 7, and 8 respectively
         # The numbers denote nesting depth and are ultimately removed
-        retval = ''
-        for line in s.split('\n'):
-            if line == '.#.':
-                retval += line + '\n'
-                continue
-            line = re.sub(self.open_and_close_tag_re, self.open_and_close_tag_re_replacement, line)
-            line = re.sub(self.open_tag_re, self.open_tag_re_replacement, line)
-            fields = line.count('\t') + 1
-            if fields < 8:
-                line = line + (8 - fields) * '\t'
-            line = re.sub(self.nested_tag_4, self.open_tag_re_replacement, line)
-            line = re.sub(self.nested_tag_3, self.open_tag_re_replacement, line)
-            line = re.sub(self.nested_tag_2, self.open_tag_re_replacement, line)
-            line = re.sub(self.nested_tag_1, self.nested_tag_1_replacement, line)
-            line = re.sub(self.nested_tags, self.nested_tags_replacement, line)
-            retval += line + '\n'
-        return retval
+        # (see tagmover.py for how, and for the regex cascade this replaced)
+        return tagmover.move_tags(s)
 
     def remove_exc(self, s):
         # Remove excess empty lines
         # Remove ".#." strings marking sentence boundaries
         # Remove <Exc___>...</Exc___> tags
-        retval = ''
+        lines = []
         for line in s.split('\n'):
-            if line.strip() == '':
+            stripped = line.strip()
+            if stripped == '':
                 continue
-            if line.strip() == '.#.':
-                retval += '\n'
+            if stripped == '.#.':
+                lines.append('\n')
                 continue
-            line = re.sub(self.exc_tag_re, '', line)
-            retval += line + '\n'
+            if 'Exc' in line:
+                line = self.exc_tag_re.sub('', line)
+            lines.append(line + '\n')
+        return ''.join(lines)
+
+    def config(self):
+        """
+        Returns the settings the tagger was made with that can change its
+        results, besides the data directory, and the size and modification
+        time of the bundle file if any.
+        """
+        retval = OrderedDict(self.settings)
+        if self.bundle is not None:
+            st = os.stat(self.bundle.filename)
+            retval['bundle'] = [st.st_size, st.st_mtime_ns]
         return retval
 
-    def __call__(self, text, tokenize=True):
+    def wait(self):
         """
-        Takes running (raw) text, returns list of sentences, each of which
-        is a list of token-nertag pairs.
+        Waits until the models that are not lazily loaded are.
+        """
+        loading.wait_all(self.artifacts)
+
+    def ready(self):
+        return all(artifact.state == 'ready' or artifact.lazy for artifact in self.artifacts.values())
+
+    def status(self):
+        """
+        Returns the load state, file size and load time of each model by name.
         """
+        return OrderedDict((name, artifact.status()) for name, artifact in self.artifacts.items())
+
+    def tag_sentences(self, sentences, timings=None, analysed=None):
+        """
+        Runs the NER stages over sentences as returned by the POS tagger,
+        returns list of sentences, each of which is a list of token-nertag
+        pairs. The proper name rules don't reach over the sentence
+        boundaries, so each distinct sentence is tagged once and sentences
+        seen before are taken from the memo. *analysed*, the sentences of
+        Tokens they were labeled from, lets the prefilter see the omorfi
+        analyses.
+        """
+        if self.sentence_memo.maxsize <= 0 or len(sentences) == 0:
+            return self.run_pipeline(sentences, timings, analysed)
+        keys = [tuple(sentence) for sentence in sentences]
+        tagged_sentences = {}
+        untagged = []
+        untagged_analysed = []
+        for i, key in enumerate(keys):
+            if key in tagged_sentences:
+                continue
+            tagged_sentences[key] = self.sentence_memo.get(key)
+            if tagged_sentences[key] is None:
+                untagged.append(key)
+                untagged_analysed.append(None if analysed is None else analysed[i])
+        if len(untagged) != 0:
+            tagged = self.run_pipeline(untagged, timings, untagged_analysed)
+            if len(tagged) != len(untagged):
+                # Sentence boundaries did not survive the pipeline
+                return self.run_pipeline(sentences, timings, analysed)
+            for key, sentence in zip(untagged, tagged):
+                tagged_sentences[key] = sentence
+                self.sentence_memo.put(key, sentence)
+        if timings is not None:
+            timings.count('memoized_sentences', len(sentences) - len(untagged))
+        return [list(tagged_sentences[key]) for key in keys]
+
+    def run_pipeline(self, sentences, timings=None, analysed=None):
+        if self.prefilter is not None:
+            return self.run_prefiltered(sentences, self.prefilter, timings, analysed)
+        return self.run_stages(sentences, timings)
+
+    def run_prefiltered(self, sentences, prefilter, timings=None, analysed=None):
+        """
+        Runs the NER stages over the sentences that *prefilter* finds might
+        contain entities, given their Tokens in *analysed* if known; the
+        others get no tags.
+        """
+        if analysed is None:
+            analysed = [None] * len(sentences)
+        is_candidate = [prefilter(sentence, tokens) for sentence, tokens in zip(sentences, analysed)]
+        candidates = [sentence for sentence, candidate in zip(sentences, is_candidate) if candidate]
+        if timings is not None:
+            timings.count('prefiltered_sentences', len(sentences) - len(candidates))
+        if len(candidates) == len(sentences):
+            return self.run_stages(sentences, timings)
+        tagged = self.run_stages(candidates, timings) if len(candidates) != 0 else []
+        if len(tagged) != len(candidates):
+            # Sentence boundaries did not survive the pipeline
+            return self.run_stages(sentences, timings)
+        tagged = iter(tagged)
+        return [next(tagged) if candidate else [(token[0], '') for token in sentence]
+                for sentence, candidate in zip(sentences, is_candidate)]
+
+    def run_stages(self, sentences, timings=None):
         pipeline = [
                     self.format_for_nertag,
                     self.normalize_lemmas,
@@ -295,9 +487,9 @@ class Finer:
                     self.proper_tag2,
                     self.move_tags,
                     self.remove_exc]
-        text = self.postagger(text,tokenize)
+        text = sentences
         for function in pipeline:
-            text = function(text)
+            text = timed(timings, function.__name__, function, text)
         sentences = []
         sentence = []
         for line in text.split('\n'):
@@ -308,3 +500,138 @@ class Finer:
             parts = line.split('\t')
             sentence.append((parts[0], parts[4]))
         return sentences
+
+    def __call__(self, text, tokenize=True, timings=None):
+        """
+        Takes running (raw) text, returns list of sentences, each of which
+        is a list of token-nertag pairs. A metrics.Timings passed as
+        *timings* gets the time spent in each stage.
+        """
+        count_input(timings, [text])
+        return self.tag_analysed(self.postagger.analyse(text, tokenize, timings), timings)
+
+    def morphology(self, text, tokenize=True, timings=None):
+        """
+        Stops after the POS tagger: returns list of sentences, each of
+        which is a list of (wordform, lemma, label, proper tag annotation)
+        tuples, without running the NER stages.
+        """
+        count_input(timings, [text])
+        return self.postagger(text, tokenize, timings)
+
+    def morphology_many(self, texts, tokenize=True, timings=None):
+        count_input(timings, texts)
+        analysed = [self.postagger.analyse(text, tokenize, timings) for text in texts]
+        return split_documents(self.label_many(analysed, timings), analysed)
+
+    def label_many(self, analysed, timings=None):
+        # The sentences of all the documents are labeled together, so that
+        # FinnPos gets them in as few batches as it can
+        return self.postagger.label([sentence for document in analysed for sentence in document], timings)
+
+    def shard(self, text, tokenize=True, count=2, timings=None):
+        """
+        Tokenizes and looks up a text and splits its sentences into at most
+        *count* shards, to be tagged separately with tag_analysed().
+        Concatenating their results gives what calling the tagger on the
+        text would, as the shards are cut at the sentence boundaries that
+        the proper name rules don't reach over.
+        """
+        return split_sentences(self.analyse(text, tokenize, timings), count)
+
+    def analyse(self, text, tokenize=True, timings=None):
+        """
+        Tokenizes and looks up a text, returns its sentences of Tokens to be
+        tagged with tag_analysed().
+        """
+        count_input(timings, [text])
+        return self.postagger.analyse(text, tokenize, timings)
+
+    def tag_analysed(self, sentences, timings=None):
+        """
+        Tags sentences of Tokens as returned by TextTagger.analyse().
+        """
+        return self.tag_sentences(self.postagger.label(sentences, timings), timings, sentences)
+
+    def analyse_block(self, text, tokenize=True, final=True, timings=None):
+        """
+        Tokenizes and looks up a block of a longer text. Unless *final* is
+        set, the text after the second to last sentence boundary is left out
+        and returned, to be prepended to the next block: the tokenizer put
+        the last boundary without seeing the text after it, so it may not be
+        where tokenizing the whole text would (eg. after an abbreviation).
+        Returns the sentences of Tokens and that remainder.
+        """
+        count_input(timings, [text])
+        rest = ''
+        if tokenize and not final:
+            sentences, converted, ends = self.postagger.tokenize_sentences(text, timings)
+            start = 0 if len(sentences) < 2 else ends[-2]
+            if start is None:
+                # The sentences can't be found in the text, keep them all
+                if len(converted) != 0:
+                    sentences.append(converted)
+            elif len(sentences) != 0 or len(converted) != 0:
+                sentences = sentences[:-1]
+                rest = text[start:]
+        else:
+            sentences = self.postagger.analyse(text, tokenize, timings)
+        return sentences, rest
+
+    def tag_block(self, text, tokenize=True, final=True, timings=None):
+        """
+        Tags a block of a longer text, see analyse_block(). Returns the
+        tagged sentences and the remainder.
+        """
+        sentences, rest = self.analyse_block(text, tokenize, final, timings)
+        if len(sentences) == 0:
+            return [], rest
+        return self.tag_analysed(sentences, timings), rest
+
+    def morphology_block(self, text, tokenize=True, final=True, timings=None):
+        # As tag_block(), stopping after the POS tagger
+        sentences, rest = self.analyse_block(text, tokenize, final, timings)
+        return self.postagger.label(sentences, timings), rest
+
+    def stream(self, pieces, tokenize=True, block_size=65536, timings=None):
+        """
+        Takes running (or pretokenized) text as a string or as an iterable of
+        strings and yields its sentences one by one, each a list of
+        token-nertag pairs. Only about *block_size* characters of input are
+        tagged at a time, so memory use does not grow with the input.
+        Running text is cut at the sentence boundaries found by the
+        tokenizer, pretokenized text at empty lines. A sentence of more than
+        MAX_SENTENCE_SIZE characters is cut into pieces tagged as sentences
+        of their own (see stream_blocks()).
+        """
+        if isinstance(pieces, str):
+            pieces = [pieces]
+        return stream_blocks(self.tag_block, pieces, tokenize, block_size, timings)
+
+    def tag_many(self, texts, tokenize=True, timings=None):
+        """
+        Tags several documents with a single pass of the NER stages over all
+        of their sentences. Returns a list with one entry per document, each
+        the same as what calling the tagger on that document would return.
+        """
+        count_input(timings, texts)
+        analysed = [self.postagger.analyse(text, tokenize, timings) for text in texts]
+        sentences = self.label_many(analysed, timings)
+        documents = split_documents(sentences, analysed)
+        tagged = self.tag_sentences(sentences, timings, [tokens for document in analysed for tokens in document]) if sentences else []
+        if len(tagged) != len(sentences):
+            # Sentence boundaries did not survive the pipeline; fall back to
+            # one document at a time
+            return [self.tag_sentences(document, timings, tokens) for document, tokens in zip(documents, analysed)]
+        retval = []
+        empty = None
+        start = 0
+        for document in documents:
+            if len(document) == 0:
+                if empty is None:
+                    empty = self.tag_sentences([])
+                retval.append(empty)
+                continue
+            retval.append(tagged[start:start + len(document)])
+            start += len(document)
+        return retval
@@ -0,0 +1,128 @@
+"""
+A compact index of the frequent words of a FinnPos model, for which
+extract_features() leaves out the prefix, suffix and character class
+features.
+
+The index keeps the entries as UTF-8 in one byte string with an array of
+offsets and an open-addressing hash table of entry numbers, three flat
+buffers that cost a few bytes per entry on top of the text, take O(1) per
+lookup and, unlike a set of str objects, stay shared between forked
+processes or come straight from a memory-mapped bundle.
+
+Which entries it holds depends on *match*: 'lines' keeps the lines of the
+file as read, newline included, which is how TextTagger has always read
+it, so that only an unterminated last line can match a word form; 'words'
+strips the line ends. The semantics must be those of the FinnPos model's
+training data;
+
+    python freqwords.py check FREQ_WORDS TRAINING_FILE
+
+compares both against a file of featurized training data and tells which
+of them it agrees with.
+"""
+import sys
+import zlib
+from array import array
+
+EMPTY = 0xFFFFFFFF
+MATCHES = ('lines', 'words')
+
+def read_entries(filename, match='lines'):
+    if match == 'lines':
+        return open(filename).readlines()
+    if match == 'words':
+        return [line.rstrip('\r\n') for line in open(filename) if line.rstrip('\r\n') != '']
+    raise ValueError("match should be one of %s, not %r" % (', '.join(MATCHES), match))
+
+class FreqWords:
+    """
+    Membership in a set of words. *data* holds the UTF-8 entries from
+    *start* on, entry i spanning offsets[i]:offsets[i + 1], and *table*
+    has a power of two slots, each EMPTY or an entry number.
+    """
+    def __init__(self, offsets, data, start, table, match='lines'):
+        self.offsets = offsets
+        self.data = data
+        self.start = start
+        self.table = table
+        self.mask = len(table) - 1
+        self.match = match
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __contains__(self, word):
+        if not isinstance(word, str):
+            return False
+        key = word.encode('utf-8', 'surrogatepass')
+        offsets = self.offsets
+        data = self.data
+        start = self.start
+        table = self.table
+        slot = zlib.crc32(key) & self.mask
+        while True:
+            i = table[slot]
+            if i == EMPTY:
+                return False
+            if data[start + offsets[i]:start + offsets[i + 1]] == key:
+                return True
+            slot = (slot + 1) & self.mask
+
+    def buffers(self):
+        """
+        Returns the offsets, entries and hash table as bytes.
+        """
+        return (bytes(memoryview(self.offsets).cast('B')), bytes(self.data[self.start:self.start + self.offsets[-1]]),
+                bytes(memoryview(self.table).cast('B')))
+
+def build(entries, match='lines'):
+    keys = sorted(set(entry.encode('utf-8', 'surrogatepass') for entry in entries))
+    offsets = array('I', [0])
+    for key in keys:
+        offsets.append(offsets[-1] + len(key))
+    # At most half full, so that probe runs stay short
+    size = 1
+    while size < 2 * len(keys):
+        size *= 2
+    table = array('I', [EMPTY]) * size
+    for i, key in enumerate(keys):
+        slot = zlib.crc32(key) & (size - 1)
+        while table[slot] != EMPTY:
+            slot = (slot + 1) & (size - 1)
+        table[slot] = i
+    return FreqWords(offsets, b''.join(keys), 0, table, match)
+
+def load(filename, match='lines'):
+    return build(read_entries(filename, match), match)
+
+def check(freq_words_file, training_file):
+    """
+    Reads FinnPos training data (word form, features, lemma, label and
+    annotation columns) and counts, for each match semantics, the tokens
+    whose affix features disagree with it: present for a frequent word or
+    missing for another one. Returns a dict of counts by semantics.
+    """
+    indices = dict((match, load(freq_words_file, match)) for match in MATCHES)
+    disagreements = dict((match, 0) for match in MATCHES)
+    tokens = 0
+    for line in open(training_file):
+        columns = line.rstrip('\n').split('\t')
+        if len(columns) < 2:
+            continue
+        tokens += 1
+        wf = columns[0]
+        has_affixes = any(feature.startswith('1-SUFFIX=') for feature in columns[1].split(' '))
+        for match, index in indices.items():
+            if (wf in index) == has_affixes:
+                disagreements[match] += 1
+    disagreements['tokens'] = tokens
+    return disagreements
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] != 'check':
+        sys.exit('usage: python freqwords.py check FREQ_WORDS TRAINING_FILE')
+    result = check(sys.argv[2], sys.argv[3])
+    print('%d tokens' % result['tokens'])
+    for match in MATCHES:
+        print('%-6s %d disagreements' % (match, result[match]))
+    sys.exit(0 if min(result[match] for match in MATCHES) == 0 else 1)
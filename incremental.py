@@ -0,0 +1,77 @@
+"""
+Tagging of documents that are edited and tagged again and again.
+
+The result for a sentence only depends on what FinnPos sees of it (see
+omorfi_postag.sentence_key()), as the proper name rules don't reach over
+sentence boundaries. So when a new revision of a document comes in, it is
+tokenized and looked up in full, which is cheap, and only its sentences
+that the last revision did not have go through FinnPos and the NER stages.
+The rest are taken from the tagged sentences kept for that revision, which
+makes the result the same as tagging the whole revision again.
+"""
+from cache import LRUCache
+from omorfi_postag import sentence_key
+
+class Revision:
+    """
+    The tagged sentences of a revision of a document by sentence key, and
+    their approximate size in bytes.
+    """
+    __slots__ = ('revision', 'sentences', 'size')
+
+    def __init__(self, revision, sentences):
+        self.revision = revision
+        self.sentences = sentences
+        self.size = sum(len(word[0]) + len(word[1]) + 2 for sentence in sentences.values() for word in sentence)
+
+class IncrementalTagger:
+    """
+    Tags revisions of documents with *tagger* (a finer.Finer or a
+    workers.WorkerPool), keeping the tagged sentences of the latest
+    revision of at most *maxsize* documents, and *maxbytes* bytes of them
+    unless that is 0.
+    """
+    def __init__(self, tagger, maxsize=1024, maxbytes=0):
+        self.tagger = tagger
+        self.store = LRUCache(maxsize, sizeof=lambda revision: revision.size, maxbytes=maxbytes)
+
+    def __call__(self, document_id, revision, text, tokenize=True, timings=None):
+        """
+        Tags revision *revision* (a number, later revisions being greater)
+        of document *document_id*. Returns the tagged sentences and the
+        number of them that were taken from the previous revision.
+        """
+        sentences = self.tagger.analyse(text, tokenize, timings)
+        if len(sentences) == 0:
+            return self.tagger.tag_analysed(sentences, timings), 0
+        keys = [sentence_key(sentence) for sentence in sentences]
+        stored = self.store.get(document_id)
+        tagged = {} if stored is None else stored.sentences
+        # Each changed sentence is tagged once, however often it occurs
+        changed = {}
+        for key, sentence in zip(keys, sentences):
+            if key not in tagged and key not in changed:
+                changed[key] = sentence
+        retagged = {}
+        if len(changed) != 0:
+            results = self.tagger.tag_analysed(list(changed.values()), timings)
+            if len(results) != len(changed):
+                # Sentence boundaries did not survive the pipeline
+                return self.tagger.tag_analysed(sentences, timings), 0
+            retagged = dict(zip(changed, results))
+        current = {}
+        for key in keys:
+            if key not in current:
+                current[key] = retagged[key] if key in retagged else tagged[key]
+        if stored is None or revision >= stored.revision:
+            self.store.put(document_id, Revision(revision, current))
+        reused = sum(1 for key in keys if key not in retagged)
+        if timings is not None:
+            timings.count('reused_sentences', reused)
+        return [list(current[key]) for key in keys], reused
+
+    def forget(self, document_id):
+        return self.store.pop(document_id) is not None
+
+    def stats(self):
+        return self.store.stats()
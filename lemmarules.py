@@ -0,0 +1,112 @@
+import re
+from bisect import bisect_left
+
+REGEX_SPECIAL = set('.^$*+?{}[]\\|()')
+
+def literal_tail(pattern):
+    """
+    Returns the literal characters a regular expression must end with, or
+    '' when that can't be told safely.
+    """
+    if '|' in pattern or '(?' in pattern:
+        return ''
+    i = len(pattern)
+    while i > 0 and pattern[i - 1] not in REGEX_SPECIAL and (i < 2 or pattern[i - 2] != '\\'):
+        i -= 1
+    return pattern[i:]
+
+class SuffixSubstitutions:
+    """
+    The (wordform ending, lemma ending) pairs of Finer.subs, indexed by lemma
+    ending. Calling it gives the same result as trying each pair in order.
+    """
+    def __init__(self, subs):
+        self.subs = subs
+        self.by_suffix = {}
+        for index, (w_end, l_end) in enumerate(subs):
+            self.by_suffix.setdefault(l_end, []).append((index, w_end, l_end))
+        self.lengths = sorted(set(len(l_end) for w_end, l_end in subs))
+        # The index relies on every lemma ending having a single, final #
+        self.indexed = all(l_end.count('#') == 1 and l_end.endswith('#') for w_end, l_end in subs)
+
+    def linear(self, wform, lemma):
+        for (w_end, l_end) in self.subs:
+            if wform.startswith(lemma.replace(l_end, w_end[:-1])):
+                return lemma.replace(l_end, w_end)
+        return lemma
+
+    def __call__(self, wform, lemma):
+        """
+        *wform* is the lowercased word form, *lemma* the lemma built so far.
+        """
+        hashes = lemma.count('#')
+        if hashes == 0:
+            # No lemma ending occurs in the lemma, so none of them change it
+            return lemma
+        if not self.indexed or hashes > 1 or not lemma.endswith('#'):
+            return self.linear(wform, lemma)
+        # With its only # at the end, a lemma ending can only occur as a
+        # suffix; any other pair leaves the lemma as it is
+        candidates = []
+        for length in self.lengths:
+            if length > len(lemma):
+                break
+            candidates.extend(self.by_suffix.get(lemma[-length:], ()))
+        candidates.sort()
+        unchanged = wform.startswith(lemma)
+        expected = 0
+        for index, w_end, l_end in candidates:
+            if unchanged and index != expected:
+                # An earlier pair that leaves the lemma as it is matched first
+                return lemma
+            stem = lemma[:-len(l_end)]
+            if wform.startswith(stem + w_end[:-1]):
+                return stem + w_end
+            expected = index + 1
+        return lemma
+
+class LemmaRegexes:
+    """
+    The (wordform regex, lemma regex, replacement) rules of lemma-errors.tsv,
+    indexed by the last literal character each lemma regex ends with.
+    Calling it applies the rules in order like a plain loop would, skipping
+    those whose lemma regex can't match.
+    """
+    def __init__(self, rules):
+        self.rules = []
+        self.by_last_char = {}
+        self.untailed = []
+        for index, (w_patt, l_patt, l_new) in enumerate(rules):
+            tail = literal_tail(l_patt)
+            self.rules.append((re.compile(w_patt + '.*'), re.compile(l_patt + '\\Z'), l_new, tail))
+            if tail:
+                self.by_last_char.setdefault(tail[-1], []).append(index)
+            else:
+                self.untailed.append(index)
+
+    def next_rule(self, lemma, start):
+        best = None
+        for indices in (self.by_last_char.get(lemma[-1:], ()), self.untailed):
+            i = bisect_left(indices, start)
+            if i < len(indices) and (best is None or indices[i] < best):
+                best = indices[i]
+        return best
+
+    def __call__(self, wform, lemma):
+        """
+        *wform* is the lowercased word form.
+        """
+        index = self.next_rule(lemma, 0)
+        while index is not None:
+            w_regex, l_regex, l_new, tail = self.rules[index]
+            if lemma.endswith(tail) and l_regex.search(lemma) != None and w_regex.fullmatch(wform):
+                lemma = l_regex.sub(l_new, lemma)
+            index = self.next_rule(lemma, index + 1)
+        return lemma
+
+def read_lemma_errors(filename):
+    rules = []
+    for line in open(filename, 'r'):
+        w_patt, l_patt, l_new = line.strip().split('\t')
+        rules.append((w_patt, l_patt, l_new))
+    return rules
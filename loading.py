@@ -0,0 +1,94 @@
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger('finer')
+
+class Artifact:
+    """
+    A model or data file that is loaded once with *load(filename)*, either
+    in a background thread after start() or on first use by get().
+    """
+    def __init__(self, name, filename, load):
+        self.name = name
+        self.filename = filename
+        self.load = load
+        self.lock = threading.Lock()
+        self.loaded = threading.Event()
+        self.state = 'pending'
+        self.lazy = False
+        self.value = None
+        self.error = None
+        self.started = None
+        self.seconds = None
+
+    def start(self):
+        with self.lock:
+            if self.state != 'pending':
+                return
+            self.state = 'loading'
+        threading.Thread(target=self.run, name='load-' + self.name, daemon=True).start()
+
+    def run(self):
+        self.started = time.perf_counter()
+        try:
+            self.value = self.load(self.filename)
+        except Exception as e:
+            self.error = e
+        self.seconds = time.perf_counter() - self.started
+        if self.error is None:
+            self.state = 'ready'
+            log.info('Loaded %s from %s in %.2f s', self.name, self.filename, self.seconds)
+        else:
+            self.state = 'failed'
+            log.error('Loading %s from %s failed after %.2f s: %r', self.name, self.filename, self.seconds, self.error)
+        self.loaded.set()
+
+    def get(self):
+        if not self.loaded.is_set():
+            with self.lock:
+                lazy = self.state == 'pending'
+                if lazy:
+                    self.state = 'loading'
+            if lazy:
+                self.run()
+            self.loaded.wait()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def status(self):
+        retval = {'state': self.state, 'file': self.filename}
+        try:
+            retval['bytes'] = os.path.getsize(self.filename)
+        except OSError:
+            pass
+        if self.seconds is not None:
+            retval['seconds'] = self.seconds
+        elif self.started is not None:
+            retval['seconds'] = time.perf_counter() - self.started
+        if self.lazy:
+            retval['lazy'] = True
+        if self.error is not None:
+            retval['error'] = repr(self.error)
+        return retval
+
+def start_all(artifacts, lazy=()):
+    """
+    Starts loading all of *artifacts* (a dict by name) except those named
+    in *lazy* concurrently in background threads.
+    """
+    for name, artifact in artifacts.items():
+        if name in lazy:
+            artifact.lazy = True
+        else:
+            artifact.start()
+
+def wait_all(artifacts):
+    """
+    Waits for the artifacts being loaded and raises the first error.
+    """
+    for artifact in artifacts.values():
+        if artifact.state != 'pending':
+            artifact.get()
@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import OrderedDict
+
+class Timings:
+    """
+    Wall time per pipeline stage and item counts for one call. Pass one as
+    the *timings* argument of Finer or TextTagger methods to fill it in.
+    """
+    def __init__(self):
+        self.seconds = OrderedDict()
+        self.counts = OrderedDict()
+
+    def add(self, stage, seconds):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def merge(self, other):
+        for stage, seconds in other.seconds.items():
+            self.add(stage, seconds)
+        for name, n in other.counts.items():
+            self.count(name, n)
+
+    def server_timing(self):
+        # Value for a Server-Timing response header, in milliseconds
+        return ', '.join('%s;dur=%.3f' % (stage, 1000 * seconds) for stage, seconds in self.seconds.items())
+
+def timed(timings, stage, function, *args):
+    """
+    Calls *function* and adds its wall time to *timings*, if given.
+    """
+    if timings is None:
+        return function(*args)
+    start = time.perf_counter()
+    retval = function(*args)
+    timings.add(stage, time.perf_counter() - start)
+    return retval
+
+class Metrics:
+    """
+    Totals of the Timings of every call, rendered in the Prometheus text
+    exposition format.
+    """
+    def __init__(self, prefix='finer'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.seconds = OrderedDict()
+        self.calls = OrderedDict()
+        self.counts = OrderedDict()
+
+    def observe(self, timings):
+        with self.lock:
+            for stage, seconds in timings.seconds.items():
+                self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+                self.calls[stage] = self.calls.get(stage, 0) + 1
+            for name, n in timings.counts.items():
+                self.counts[name] = self.counts.get(name, 0) + n
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def render(self, gauges=None, counters=None):
+        """
+        *gauges* maps further metric names to their current values, or to
+        dicts from label sets (eg. 'worker="0"') to values. *counters* maps
+        names to running totals kept elsewhere, exported with a _total
+        suffix.
+        """
+        lines = []
+        with self.lock:
+            name = self.prefix + '_stage_seconds_total'
+            lines.append('# HELP %s Wall time spent in each pipeline stage.' % name)
+            lines.append('# TYPE %s counter' % name)
+            for stage, seconds in self.seconds.items():
+                lines.append('%s{stage="%s"} %.6f' % (name, stage, seconds))
+            name = self.prefix + '_stage_calls_total'
+            lines.append('# HELP %s Number of timed calls that ran each pipeline stage.' % name)
+            lines.append('# TYPE %s counter' % name)
+            for stage, calls in self.calls.items():
+                lines.append('%s{stage="%s"} %d' % (name, stage, calls))
+            for counter, n in self.counts.items():
+                name = '%s_%s_total' % (self.prefix, counter)
+                lines.append('# TYPE %s counter' % name)
+                lines.append('%s %d' % (name, n))
+        for counter, n in sorted((counters or {}).items()):
+            name = '%s_%s_total' % (self.prefix, counter)
+            lines.append('# TYPE %s counter' % name)
+            lines.append('%s %s' % (name, n))
+        for gauge, value in sorted((gauges or {}).items()):
+            name = '%s_%s' % (self.prefix, gauge)
+            lines.append('# TYPE %s gauge' % name)
+            if isinstance(value, dict):
+                for labels, labeled_value in value.items():
+                    lines.append('%s{%s} %s' % (name, labels, labeled_value))
+            else:
+                lines.append('%s %s' % (name, value))
+        return '\n'.join(lines) + '\n'
@@ -1,12 +1,20 @@
+import logging
 import os
 import re
+import threading
+import time
 import hfst
 import finnpos
+import freqwords
+import loading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from cache import LRUCache
+from metrics import Timings, timed
+
+log = logging.getLogger('finer')
 
 word_id_re = re.compile('\[WORD_ID=.[^\[]*')
-uc_re = re.compile(".*([A-Z]|Å|Ä|Ö).*")
-digit_re = re.compile(".*[0-9].*")
-dash_re = re.compile(".*-.*")
 
 def get_lemma(string):
     lemma_parts = []
@@ -48,125 +56,138 @@ def filter_ftb_analyses(analyses):
     min_wbs = min(map(lambda x: x.count('[WORD_ID='), analyses))
     return list(filter(lambda x: x.count('[WORD_ID=') == min_wbs, analyses))
 
-def convert(cohorts):
-    result = []
-
-    for wordform, cohort in cohorts:
-        analyses = []
-        for analysis in cohort:
-
-            if wordform == analysis or analysis == wordform + '+?':
-                analyses = []
-            else:
-                analyses.append(analysis)
-                
-        if len(analyses) == 0:
-            result.append('%s\t_\t_\t_\t_' % wordform)
+class Token:
+    """
+    A looked up token: its surface form and, unless it got no analyses, the
+    omorfi labels and the (label, lemma) pairs of its analyses.
+    """
+    __slots__ = ('wordform', 'labels', 'lemmas', 'feats', 'label_str', 'ann', 'head')
+
+    def __init__(self, wordform, labels=None, lemmas=None):
+        self.wordform = wordform
+        self.labels = labels
+        self.lemmas = lemmas
+        if lemmas is None:
+            self.feats = '_'
+            self.label_str = '_'
+            self.ann = '_'
+        else:
+            self.feats = ' '.join(["OMORFI_FEAT:" + label for label in labels])
+            self.label_str = ' '.join(labels)
+            # FinnPos passes the annotation column through untouched
+            self.ann = str(lemmas).replace(' ', '')
+        # The features of FinnPos input that come before the context ones
+        features = []
+        if self.feats != '_':
+            features = self.feats.split(' ')
+        if lemmas is not None:
+            features += ["FEAT:" + label for label, lemma in lemmas] or ["NO_LABELS"]
+        self.head = ''.join(feature + ' ' for feature in features if feature)
+
+    def line(self):
+        return '%s\t%s\t%s\t%s\t%s' % (self.wordform, self.feats, '_', self.label_str, self.ann)
+
+def sentence_key(sentence):
+    # All that FinnPos, and so the rest of the pipeline, sees of a sentence
+    return tuple((token.wordform, token.label_str, token.ann) for token in sentence)
+
+def convert_cohort(wordform, cohort):
+    analyses = []
+    for analysis in cohort:
+
+        if wordform == analysis or analysis == wordform + '+?':
             analyses = []
-            continue
-        analyses = filter_ftb_analyses(analyses)
-        lemmas = get_lemmas(analyses)
-        lemma_str = str(lemmas).replace(' ','')
-        labels = get_labels(analyses)
-        feats = '_'
-
-        if labels != []:
-            label_feats = map(lambda x: "OMORFI_FEAT:" + x, labels)
-            feats = ' '.join(label_feats)
-
-        label_str = '_' 
-                
-        if labels != []:
-            label_str = ' '.join(labels)
-                
-        result.append('%s\t%s\t%s\t%s\t%s' % (wordform, feats, '_', label_str, lemma_str))
-
-        analyses = []
-        continue
-        
-    return result
-
-def extract_features(sentences, freq_words):
-    # Boundary word.
-    BOUNDARY = "_#_"
-
-    # Maximum length of extracted suffix and prefix features.
-    MAX_SUF_LEN = 10
-    MAX_PRE_LEN = 10
-
-    def get_wf(i, sentence):
-        return BOUNDARY if i < 0 or i + 1 > len(sentence) else sentence[i][0]
-
-    def get_suffixes(wf):
-        return [ "%u-SUFFIX=%s" % (i, wf[-i:]) 
-                 for i in range(1, min(MAX_SUF_LEN + 1, len(wf) + 1)) ]
-
-    def get_prefixes(wf):
-        return [ "%u-PREFIX=%s" % (i, wf[:i]) 
-                 for i in range(1, min(MAX_PRE_LEN + 1, len(wf) + 1)) ]
-
-    def has_uc(wf):
-        return "HAS_UC" if re.match(uc_re, wf) else None
-
-    def has_digit(wf):
-        return "HAS_DIGIT" if re.match(digit_re, wf) else None
+        else:
+            analyses.append(analysis)
 
-    def has_dash(wf):
-        return "HAS_DASH" if re.match(dash_re, wf) else None
+    if len(analyses) == 0:
+        return Token(wordform)
+    analyses = filter_ftb_analyses(analyses)
+    labels = get_labels(analyses)
+    # The annotation column used to be str(lemmas) with the spaces removed,
+    # read back with eval(), so the same goes for the pairs kept here
+    lemmas = [(label.replace(' ', ''), lemma.replace(' ', '')) for label, lemma in get_lemmas(analyses)]
+    return Token(wordform, labels, lemmas)
 
+def convert(cohorts):
+    return [convert_cohort(wordform, cohort) for wordform, cohort in cohorts]
+
+# Boundary word.
+BOUNDARY = "_#_"
+
+# Maximum length of extracted suffix and prefix features.
+MAX_SUF_LEN = 10
+MAX_PRE_LEN = 10
+
+UC_CHARS = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZÅÄÖ')
+DIGIT_CHARS = frozenset('0123456789')
+
+def wordform_features(wf, freq_words):
+    """
+    Returns the features of FinnPos input that depend on the word form only:
+    the WORD and WORD_LEN features, and the ones from LC_WORD on.
+    """
+    features = ['LC_WORD=' + wf.lower()]
+    if not wf in freq_words:
+        features += [ "%u-SUFFIX=%s" % (i, wf[-i:])
+                      for i in range(1, min(MAX_SUF_LEN + 1, len(wf) + 1)) ]
+        features += [ "%u-PREFIX=%s" % (i, wf[:i])
+                      for i in range(1, min(MAX_PRE_LEN + 1, len(wf) + 1)) ]
+        # The flags used to come from '.*X.*' regexes, which stop at a newline
+        first_line = wf.split('\n', 1)[0]
+        if not UC_CHARS.isdisjoint(first_line):
+            features.append("HAS_UC")
+        if not DIGIT_CHARS.isdisjoint(first_line):
+            features.append("HAS_DIGIT")
+        if '-' in first_line:
+            features.append("HAS_DASH")
+    return 'WORD=%s WORD_LEN=%d' % (wf, len(wf)), ' '.join(features)
+
+def extract_features(sentences, freq_words, cache=None):
+    """
+    Takes sentences of Tokens, returns for each sentence a list of (token,
+    FinnPos input line) pairs. *cache* keeps the wordform_features() of
+    word forms between calls, if given.
+    """
+    if cache is None:
+        cache = LRUCache(0)
+    seen = {}
     retval = []
     for sentence in sentences:
+        # NB. the context features get the first character of the
+        # neighbouring token's line, which is what the FinnPos model
+        # currently gets
+        context = [BOUNDARY, BOUNDARY] + [token.wordform[:1] or '\t' for token in sentence] + [BOUNDARY, BOUNDARY]
         this_labeled_sentence = []
         for i, token in enumerate(sentence):
-            try:
-                wf, feats, lemma, label, ann = token.split('\t')
-            except ValueError:
+            wf = token.wordform
+            if '\t' in wf:
+                # Would not survive the trip through FinnPos' columns
                 continue
-            features = []                
-
-            if feats != '_':
-                features = feats.split(' ')
-        
-            if not ann in ['_', '']:
-                lemma_list = ann
-                if ' ' in ann:
-                    lemma_list = ann[:ann.find(' ')]
-                
-                label_feats = [ "FEAT:" + label for label in 
-                                map(lambda x: x[0], eval(lemma_list)) ]
-
-                if len(label_feats) != 0:
-                    features += label_feats
-                else:
-                    features.append("NO_LABELS")
-
-            features.append('PPWORD=' + get_wf(i - 2, sentence))
-            features.append('PWORD='  + get_wf(i - 1, sentence))
-            features.append('WORD='   + wf)
-            features.append('WORD_LEN='   + str(len(wf)))
-            features.append('NWORD='  + get_wf(i + 1, sentence))
-            features.append('NNWORD=' + get_wf(i + 2, sentence))
-            
-            features.append('PWORDPAIR='  + get_wf(i - 1, sentence) + "_" + wf)
-            features.append('NWORDPAIR='  + wf + "_" + get_wf(i + 1, sentence))
-            
-            features.append("LC_WORD=" + wf.lower())
-            
-            if not wf in freq_words:
-                features += get_suffixes(wf)
-                features += get_prefixes(wf)
-            
-                features.append(has_uc(wf))
-                features.append(has_digit(wf))
-                features.append(has_dash(wf))
-            
-            feat_str = " ".join(filter(None, features))
-        
-            this_labeled_sentence.append("%s\t%s\t%s\t%s\t%s" % (wf, feat_str, lemma, label, ann))
+            wf_features = seen.get(wf)
+            if wf_features is None:
+                wf_features = cache.get(wf)
+                if wf_features is None:
+                    wf_features = wordform_features(wf, freq_words)
+                    cache.put(wf, wf_features)
+                seen[wf] = wf_features
+            word, rest = wf_features
+            pword = context[i + 1]
+            nword = context[i + 3]
+            feat_str = '%sPPWORD=%s PWORD=%s %s NWORD=%s NNWORD=%s PWORDPAIR=%s_%s NWORDPAIR=%s_%s %s' % (
+                token.head, context[i], pword, word, nword, context[i + 4], pword, wf, wf, nword, rest)
+            this_labeled_sentence.append((token, "%s\t%s\t%s\t%s\t%s" % (wf, feat_str, '_', token.label_str, token.ann)))
         retval.append(this_labeled_sentence)
     return retval
 
-def restore_lemmas(labeled_sentence):
+def restore_lemmas(labeled_sentence, tokens):
+    """
+    Takes FinnPos output for a sentence, as a string or as a list of
+    lines, and the Tokens it was made from, returns (wordform, lemma,
+    label, proper tag annotation) tuples.
+    """
+    if isinstance(labeled_sentence, str):
+        labeled_sentence = labeled_sentence.strip().split('\n')
 
     retval = []
 
@@ -200,17 +221,12 @@ def restore_lemmas(labeled_sentence):
                 return False
         return True
 
-    for token in labeled_sentence.strip().split('\n'):
-        wf, feats, lemma, label, ann = token.split('\t')
-
-        lemmas = ann
-        if ann.find(' ') != -1:
-            lemmas = ann[:ann.find(' ')]
-            ann = ann[ann.find(' ') + 1:]
+    for token, line in zip(tokens, labeled_sentence):
+        wf, feats, lemma, label, ann = line.split('\t')
 
         ann = "_"
-        if lemmas != '_':
-            lemmas = eval(lemmas)
+        lemmas = token.lemmas
+        if lemmas is not None:
             lemma_candidate = None
             
             for this_label, this_lemma in lemmas:
@@ -231,9 +247,102 @@ def restore_lemmas(labeled_sentence):
         retval.append((wf, lemma, label, ann))
     return retval
 
+def text_blocks(pieces, block_size=65536, blank_lines_only=False, max_size=None):
+    """
+    Regroups an iterable of text pieces (eg. lines of a file) into blocks
+    of roughly *block_size* characters. Blocks are cut at an empty line when
+    there is one, since those end sentences in both running and pretokenized
+    text, and otherwise at a line break or space unless *blank_lines_only*
+    is set. Text with no such place in *max_size* characters (by default
+    four blocks) is cut regardless, at a line break or space if it has one,
+    and the cut is logged.
+    """
+    if max_size is None:
+        max_size = 4 * block_size
+    max_size = max(max_size, block_size)
+    separators = ['\n\n'] if blank_lines_only else ['\n\n', '\n', ' ']
+
+    def find_cut(text, start):
+        end = start + block_size
+        for separator in separators:
+            idx = text.rfind(separator, start, end)
+            if idx != -1:
+                return idx + len(separator)
+        for separator in separators:
+            idx = text.find(separator, start, start + max_size)
+            if idx != -1:
+                return idx + len(separator)
+        if len(text) - start < max_size:
+            return -1
+        log.warning('Cutting text with no %s in %d characters', 'empty line' if blank_lines_only else 'whitespace', max_size)
+        for separator in ('\n', ' '):
+            idx = text.rfind(separator, start + 1, start + max_size)
+            if idx != -1:
+                return idx + len(separator)
+        return start + max_size
+
+    buffered = []
+    size = 0
+    # The buffer is only joined and searched again once another block has
+    # come in, so text without a cut takes linear time
+    wanted = block_size
+    for piece in pieces:
+        buffered.append(piece)
+        size += len(piece)
+        if size < wanted:
+            continue
+        text = ''.join(buffered)
+        start = 0
+        while len(text) - start >= block_size:
+            cut = find_cut(text, start)
+            if cut == -1:
+                break
+            yield text[start:cut]
+            start = cut
+        buffered = [text[start:]]
+        size = len(buffered[0])
+        wanted = size + block_size if size >= block_size else block_size
+    text = ''.join(buffered)
+    if text != '':
+        yield text
+
+def read_transducer(filename):
+    ls = hfst.HfstInputStream(filename)
+    transducer = ls.read()
+    ls.close()
+    return transducer
+
+def load_labeler(filename):
+    labeler = finnpos.Labeler()
+    labeler.load_model(filename)
+    return labeler
+
 class TextTagger:
     def __init__(self, datapath = None, tokenizer_file = "omorfi_tokenize.pmatch", lookup_file = "omorfi.tagtools.optcap.hfst",
-                 freq_words_file = "freq_words", model_file = "ftb.omorfi.model"):
+                 freq_words_file = "freq_words", model_file = "ftb.omorfi.model", cache_size = 65536, memo_size = 4096,
+                 lazy = (), wait = True, bundle = None, freq_words_match = 'lines', label_batch_size = 64,
+                 label_thread = False):
+        """
+        *cache_size* bounds the number of looked up Tokens kept in
+        memory between calls, keyed by surface form; 0 disables the cache.
+        *memo_size* bounds the number of labeled sentences kept likewise,
+        keyed by their Tokens.
+
+        The tokenizer, lookup transducer, frequent words and FinnPos model
+        are loaded concurrently, except those named in *lazy*, which are
+        loaded when first used. Unless *wait* is set, loading goes on in
+        the background after this returns and the first call waits for it.
+        With *bundle*, an opened bundle.Bundle, the frequent words are
+        looked up in the bundle instead. *freq_words_match* says how the
+        lines of the frequent words file are matched, see freqwords.py.
+
+        Up to *label_batch_size* sentences are given to FinnPos at once,
+        separated by empty lines, once a first batch has been labeled the
+        same way as one sentence at a time; 1 labels each sentence alone.
+        With *label_thread*, FinnPos runs in a thread of its own while the
+        features of the next batch are extracted, which only pays off if it
+        releases the GIL.
+        """
         if datapath != None:
             if not os.path.isabs(tokenizer_file):
                 tokenizer_file = os.path.join(datapath, tokenizer_file)
@@ -254,52 +363,242 @@ class TextTagger:
         for filename in (tokenizer_file, freq_words_file, model_file):
             if not os.path.isfile(filename):
                 raise FileNotFoundError(filename)
-        ls = hfst.HfstInputStream(lookup_file)
-        self.lookup = ls.read()
-        ls.close()
-        self.tokenizer = hfst.PmatchContainer(tokenizer_file)
-        self.freq_words = set(open(freq_words_file).readlines())
-        self.tagger = finnpos.Labeler()
-        self.tagger.load_model(model_file)
-
-    def __call__(self, text_to_tag,tokenize=True):
-        retval = []
+        self.artifacts = OrderedDict([
+            ('tokenizer', loading.Artifact('tokenizer', tokenizer_file, hfst.PmatchContainer)),
+            ('lookup', loading.Artifact('lookup', lookup_file, read_transducer)),
+            ('freq_words', loading.Artifact('freq_words', freq_words_file,
+                                            lambda filename: freqwords.load(filename, freq_words_match)) if bundle is None else
+                           loading.Artifact('freq_words', bundle.filename, lambda filename: bundle.freq_words(freq_words_match))),
+            ('model', loading.Artifact('model', model_file, load_labeler))])
+        loading.start_all(self.artifacts, lazy)
+        if wait:
+            loading.wait_all(self.artifacts)
+        self.cache = LRUCache(cache_size)
+        self.feature_cache = LRUCache(cache_size)
+        self.sentence_memo = LRUCache(memo_size)
+        self.label_batch_size = label_batch_size
+        self.label_thread = label_thread
+        # Whether FinnPos labels a batch like its sentences one by one; None
+        # until the first batch tells
+        self.batch_labeling = None
+        self.batch_lock = threading.Lock()
+        self.executor = None
+        self.executor_pid = None
+
+    @property
+    def tokenizer(self):
+        return self.artifacts['tokenizer'].get()
+
+    @property
+    def lookup(self):
+        return self.artifacts['lookup'].get()
+
+    @property
+    def freq_words(self):
+        return self.artifacts['freq_words'].get()
+
+    @property
+    def tagger(self):
+        return self.artifacts['model'].get()
+
+    def convert_token(self, token):
+        # Pretokenized input: the analyses depend on the surface form only
+        converted = self.cache.get(token)
+        if converted is None:
+            cohort = [output[0] for output in self.lookup.lookup(token)]
+            converted = convert_cohort(token, cohort)
+            self.cache.put(token, converted)
+        return converted
+
+    def convert_locations(self, wordform, cohort):
+        # Tokenizer output: the cohort comes from locate(), so it is part of the key
+        key = (wordform, tuple(cohort))
+        converted = self.cache.get(key)
+        if converted is None:
+            converted = convert_cohort(wordform, cohort)
+            self.cache.put(key, converted)
+        return converted
+
+    def tokenize_sentences(self, text_to_tag, timings=None):
+        """
+        Tokenizes running text. Returns the sentences closed by a sentence
+        boundary, the Tokens following the last boundary, and the offset in
+        *text_to_tag* where each sentence ends (None if unknown).
+        """
+        sentences = []
+        converted = []
+        pos = 0
+        ends = []
+        located = timed(timings, 'tokenize', self.tokenizer.locate, text_to_tag)
+        start = time.perf_counter()
+        for locations in located:
+            wordform = locations[0].input
+            if pos is not None:
+                idx = text_to_tag.find(wordform, pos)
+                pos = None if idx == -1 else idx + len(wordform)
+            cohort = []
+            for location in locations:
+                output = location.output
+                if output != '@_NONMATCHING_@' and ((output != location.input and output != '') or len(locations) == 1):
+                    cohort.append(location.output)
+            if len(cohort) != 0:
+                converted.append(self.convert_locations(wordform, cohort))
+            if locations[0].tag == '<Boundary=Sentence>':
+                sentences.append(converted)
+                converted = []
+                ends.append(pos)
+        if timings is not None:
+            timings.add('lookup', time.perf_counter() - start)
+        return sentences, converted, ends
+
+    def analyse(self, text_to_tag, tokenize=True, timings=None):
+        """
+        Returns the sentences of *text_to_tag* as lists of Tokens.
+        Pretokenized text has one token per line and an empty line after
+        each sentence.
+        """
         sentences = []
-        cohorts = []
+        converted = []
         if tokenize == False:
+            start = time.perf_counter()
             tokens = text_to_tag.split("\n")
             for token in tokens:
                 if token=="":
-                    if len(cohorts) != 0:
-                        sentences.append(convert(cohorts))
-                        cohorts = []
+                    if len(converted) != 0:
+                        sentences.append(converted)
+                        converted = []
                 else:
-                    cohort = []
-                    outputs = self.lookup.lookup(token)
-                    for output in outputs:
-                        cohort.append(output[0])
-                    cohorts.append((token,cohort))
+                    converted.append(self.convert_token(token))
+            if timings is not None:
+                timings.add('lookup', time.perf_counter() - start)
         else:
-            for locations in self.tokenizer.locate(text_to_tag):
-                wordform = locations[0].input
-                cohort = []
-                for location in locations:
-                    output = location.output
-                    if output != '@_NONMATCHING_@' and ((output != location.input and output != '') or len(locations) == 1):
-                        cohort.append(location.output)
-                if len(cohort) != 0:
-                    cohorts.append((wordform, cohort))
-                if locations[0].tag == '<Boundary=Sentence>':
-                    sentences.append(convert(cohorts))
-                    cohorts = []
-        if len(cohorts) != 0:
-            sentences.append(convert(cohorts))
-
-        labeled_sentences = []
-        for featurized_sentence in extract_features(sentences, self.freq_words):
-            this_sentence = []
-            for token in restore_lemmas(self.tagger.label('\n'.join(featurized_sentence))):
-                this_sentence.append(token)
-            retval.append(this_sentence)
+            sentences, converted, ends = self.tokenize_sentences(text_to_tag, timings)
+        if len(converted) != 0:
+            sentences.append(converted)
+        return sentences
+
+    def label(self, sentences, timings=None):
+        """
+        Runs FinnPos over sentences of Tokens, returns list of sentences of
+        (wordform, lemma, label, proper tag annotation) tuples.
+        """
+        # FinnPos labels each sentence on its own, so a sentence made of the
+        # same Tokens is labeled once and its result reused
+        keys = [sentence_key(sentence) for sentence in sentences]
+        labeled_sentences = {}
+        unlabeled = []
+        for key, sentence in zip(keys, sentences):
+            if key in labeled_sentences:
+                continue
+            labeled_sentences[key] = self.sentence_memo.get(key)
+            if labeled_sentences[key] is None:
+                unlabeled.append((key, sentence))
+        batch_size = max(1, self.label_batch_size)
+        pending = None
+        for start in range(0, len(unlabeled), batch_size):
+            batch = unlabeled[start:start + batch_size]
+            featurized = timed(timings, 'features', extract_features, [sentence for key, sentence in batch],
+                               self.freq_words, self.feature_cache)
+            # The previous batch is labeled while this one was featurized
+            if pending is not None:
+                self.store_labeled(pending, labeled_sentences, timings)
+            if self.label_thread:
+                # The labeling thread times itself separately, as the caller
+                # keeps adding to *timings* meanwhile
+                thread_timings = Timings() if timings is not None else None
+                pending = (batch, self.labeling_executor().submit(self.label_featurized, featurized, thread_timings),
+                           thread_timings)
+            else:
+                pending = (batch, self.label_featurized(featurized, timings), None)
+        if pending is not None:
+            self.store_labeled(pending, labeled_sentences, timings)
+        retval = [list(labeled_sentences[key]) for key in keys]
+        if timings is not None:
+            timings.count('labeled_sentences', len(unlabeled))
+            timings.count('sentences', len(retval))
+            timings.count('tokens', sum(len(sentence) for sentence in retval))
+        return retval
+
+    def store_labeled(self, pending, labeled_sentences, timings=None):
+        batch, labeled, thread_timings = pending
+        if not isinstance(labeled, list):
+            labeled = labeled.result()
+        if thread_timings is not None:
+            timings.merge(thread_timings)
+        for (key, sentence), labeled_sentence in zip(batch, labeled):
+            labeled_sentences[key] = labeled_sentence
+            self.sentence_memo.put(key, labeled_sentence)
+
+    def labeling_executor(self):
+        # A forked worker process gets a thread of its own
+        if self.executor is None or self.executor_pid != os.getpid():
+            self.executor = ThreadPoolExecutor(1, thread_name_prefix='finnpos')
+            self.executor_pid = os.getpid()
+        return self.executor
+
+    def label_one(self, tokens, lines, timings=None):
+        labeled = timed(timings, 'finnpos', self.tagger.label, '\n'.join(lines))
+        return timed(timings, 'restore_lemmas', restore_lemmas, labeled, tokens)
+
+    def label_featurized(self, featurized, timings=None):
+        """
+        Labels sentences as returned by extract_features(), as many as
+        possible with a single call to FinnPos.
+        """
+        sentences = [([token for token, line in sentence], [line for token, line in sentence]) for sentence in featurized]
+        # Sentences that an empty line or a line break in a word form would
+        # throw out of line are labeled on their own
+        batchable = [i for i, (tokens, lines) in enumerate(sentences)
+                     if len(lines) != 0 and not any('\n' in line for line in lines)]
+        retval = [None] * len(sentences)
+        calls = 0
+        if self.batch_labeling is not False and len(batchable) > 1:
+            labeled = self.label_batch([sentences[i][1] for i in batchable], timings)
+            calls += 1
+            if labeled is not None and self.batch_labeling is None:
+                with self.batch_lock:
+                    if self.batch_labeling is None:
+                        one_by_one = [timed(timings, 'finnpos', self.tagger.label, '\n'.join(sentences[i][1])).strip().split('\n')
+                                      for i in batchable]
+                        calls += len(batchable)
+                        self.batch_labeling = labeled == one_by_one
+                        if not self.batch_labeling:
+                            log.warning('FinnPos labels sentences differently in batches; labeling them one by one')
+            if labeled is not None and self.batch_labeling:
+                for i, lines in zip(batchable, labeled):
+                    retval[i] = timed(timings, 'restore_lemmas', restore_lemmas, lines, sentences[i][0])
+        for i, (tokens, lines) in enumerate(sentences):
+            if retval[i] is None:
+                retval[i] = self.label_one(tokens, lines, timings)
+                calls += 1
+        if timings is not None:
+            timings.count('finnpos_calls', calls)
+        return retval
+
+    def label_batch(self, sentences, timings=None):
+        """
+        Labels sentences of FinnPos input lines with one call, returns the
+        output lines of each, or None if they don't line up with the input.
+        """
+        try:
+            labeled = timed(timings, 'finnpos', self.tagger.label, '\n\n'.join('\n'.join(lines) for lines in sentences))
+        except Exception as e:
+            if self.batch_labeling is None:
+                log.warning('FinnPos failed to label a batch of sentences (%r); labeling them one by one', e)
+                self.batch_labeling = False
+            return None
+        retval = [[]]
+        for line in labeled.strip().split('\n'):
+            if line == '':
+                if len(retval[-1]) != 0:
+                    retval.append([])
+            else:
+                retval[-1].append(line)
+        # Stripped like the output for a sentence labeled alone
+        retval = ['\n'.join(lines).strip().split('\n') for lines in retval]
+        if [len(lines) for lines in retval] != [len(lines) for lines in sentences]:
+            return None
         return retval
 
+    def __call__(self, text_to_tag,tokenize=True, timings=None):
+        return self.label(self.analyse(text_to_tag, tokenize, timings), timings)
@@ -0,0 +1,249 @@
+"""
+A conservative test for sentences in which the proper name rules can't
+find anything, so that Finer can leave them out of the pmatch phases and
+tag their tokens with nothing right away.
+
+A sentence goes through the rules as usual if any of its tokens
+  - has a character other than a lower case letter, apart from hyphens
+    between letters and a single punctuation mark (with initial_capitals,
+    the first token of a sentence may start with a capital if omorfi
+    knows it and has no proper noun reading for it),
+  - has a PROPER label from FinnPos or among its omorfi analyses, or a
+    proper tag annotation, or
+  - has a lemma, or a part of a compound lemma, from FinnPos or from any
+    of its omorfi analyses among the trigger lemmas: the month, day,
+    number, currency and unit words and the like that Timex and Numex
+    rules start from, the common nouns of organizations and events that
+    Enamex rules tag in lower case, and every lower case word quoted in
+    the rule sources found in the data directory.
+
+The omorfi analyses come from the Tokens the sentence was labeled from
+(see omorfi_postag.TextTagger.analyse()).
+
+The trigger lemmas are a list kept by hand, not derived from the compiled
+rules, so whether they are conservative enough for a given set of rules is
+a question of fact. Before turning FINER_PREFILTER on for a data
+directory, run both
+
+    python prefilter.py check [--datadir DIR]
+
+which checks with the models in DIR that ordinary sentences are left out
+and that sentences with names, dates and amounts are not, and
+
+    python prefilter.py validate [--datadir DIR] [--pretokenized] FILE...
+
+which tags the documents in FILEs (separated by blank lines) both ways
+and reports every sentence the prefilter would have left out that the
+rules tag something in, with the share of sentences left out. Both must
+pass, the latter on a representative corpus. Lemmas to add to the
+triggers go in entity-triggers, one per line, in the data directory.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+PUNCTUATION = frozenset('.,;:!?"\'()[]-–—…')
+
+TRIGGER_LEMMAS = frozenset('''
+tammikuu helmikuu maaliskuu huhtikuu toukokuu kesäkuu heinäkuu elokuu syyskuu lokakuu marraskuu joulukuu kuu
+maanantai tiistai keskiviikko torstai perjantai lauantai sunnuntai viikonloppu arki
+vuosi vuosikymmen vuosisata vuosituhat kausi viikko päivä vuorokausi kello tunti minuutti sekunti
+aamu aamupäivä päivällä iltapäivä ilta yö keskipäivä keskiyö kevät kesä syksy talvi
+joulu uusivuosi pääsiäinen juhannus vappu itsenäisyyspäivä
+eilen tänään huomenna toissapäivänä ylihuomenna nykyään
+nolla yksi kaksi kolme neljä viisi kuusi seitsemän kahdeksan yhdeksän kymmenen toista kymmentä
+sata tuhat miljoona miljardi biljoona puoli puolitoista tusina
+ensimmäinen toinen kolmas neljäs viides kuudes seitsemäs kahdeksas yhdeksäs kymmenes sadas tuhannes
+euro sentti markka penni dollari punta kruunu jeni frangi rupla juan
+prosentti prosenttiyksikkö promille
+metri kilometri senttimetri millimetri mailia jalka tuuma
+gramma kilogramma kilo tonni litra desilitra millilitra
+aste hehtaari aari neliö neliömetri neliökilometri kuutio kuutiometri
+watti kilowatti megawatti voltti ampeeri tavu kilotavu megatavu gigatavu
+eduskunta valtioneuvosto hallitus ministeriö ministeri presidentti kanslia virasto laitos keskus vaalit
+kunta kaupunki kaupunginvaltuusto kaupunginhallitus maakunta lääni seurakunta kirkko hiippakunta
+yliopisto korkeakoulu ammattikorkeakoulu koulu lukio opisto akatemia sairaala
+puolue liitto yhdistys järjestö säätiö seura kerho komitea toimikunta neuvosto komissio parlamentti
+yhtiö osakeyhtiö konserni pankki kauppa tehdas oy oyj ab ry
+oikeus tuomioistuin hovioikeus käräjäoikeus
+armeija puolustusvoimat poliisi tulli
+sota talvisota jatkosota maailmansota kriisi vallankumous sisällissota
+olympialaiset olympiakisat kisat kilpailut mestaruuskilpailut maailmanmestaruus cup turnaus sarja liiga
+festivaali juhlat messut näyttely konferenssi kokous huippukokous
+'''.split())
+
+# Rule sources, as opposed to the compiled rules, whose quoted words are
+# added to the triggers
+RULE_SOURCE_SUFFIXES = ('.pmatch', '.pmx', '.pmatch.txt')
+
+quoted_re = re.compile(r'"([^"\n]*)"|\{([^{}\n]*)\}')
+lower_word_re = re.compile(r'(?<!\w)[a-zåäöšž]+(?:-[a-zåäöšž]+)*(?!\w)')
+
+lemma_part_re = re.compile(r'[#|\-]')
+
+def rule_source_words(datadir):
+    """
+    The lower case words quoted in the pmatch rule sources in *datadir*,
+    leaving out compiled rules.
+    """
+    words = set()
+    for filename in sorted(os.listdir(datadir)):
+        path = os.path.join(datadir, filename)
+        if not filename.endswith(RULE_SOURCE_SUFFIXES) or not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data.startswith(b'HFST') or b'\0' in data:
+            continue
+        for match in quoted_re.finditer(data.decode('utf-8', 'replace')):
+            words.update(lower_word_re.findall(match.group(1) or match.group(2) or ''))
+    return words
+
+def read_triggers(datadir):
+    """
+    The default trigger lemmas, the words quoted in the rule sources in
+    *datadir* and those listed in entity-triggers there, if it exists.
+    """
+    triggers = set(TRIGGER_LEMMAS)
+    triggers.update(rule_source_words(datadir))
+    filename = os.path.join(datadir, 'entity-triggers')
+    if os.path.exists(filename):
+        for line in open(filename):
+            if line.strip() != '':
+                triggers.add(line.strip().lower())
+    return frozenset(triggers)
+
+def plain_word(wordform):
+    if wordform in PUNCTUATION:
+        return True
+    parts = wordform.split('-')
+    return wordform.strip('-') != '' and all(part == '' or (part.isalpha() and part.islower()) for part in parts)
+
+class EntityPrefilter:
+    """
+    Tells whether a labeled sentence, a list of (word form, lemma, label,
+    annotation) tuples, might contain an entity, given the Tokens it was
+    labeled from if known. With *initial_capitals*, a capital starting a
+    sentence on a word omorfi has no proper noun reading for is let
+    through; check that this holds for the rules in use first.
+    """
+    def __init__(self, triggers=TRIGGER_LEMMAS, initial_capitals=False):
+        self.triggers = triggers
+        self.initial_capitals = initial_capitals
+
+    def lemma_triggers(self, lemma):
+        lemma = lemma.lower()
+        if lemma.replace('#', '').replace('|', '') in self.triggers:
+            return True
+        return any(part in self.triggers for part in lemma_part_re.split(lemma))
+
+    def __call__(self, sentence, tokens=None):
+        if tokens is not None and len(tokens) != len(sentence):
+            # Tokens FinnPos could not be given are missing from the sentence
+            tokens = None
+        for i, (wordform, lemma, label, ann) in enumerate(sentence):
+            token = None if tokens is None else tokens[i]
+            analyses = () if token is None or token.lemmas is None else token.lemmas
+            if 'PROPER' in label or ann != '_' or any('PROPER' in this_label for this_label, this_lemma in analyses):
+                return True
+            if not plain_word(wordform):
+                # A capital starting the sentence, on a word omorfi knows
+                if (not self.initial_capitals or i != 0 or len(analyses) == 0 or not wordform[:1].isupper() or
+                        not plain_word(wordform[:1].lower() + wordform[1:])):
+                    return True
+            if self.lemma_triggers(lemma):
+                return True
+            if any(self.lemma_triggers(this_lemma) for this_label, this_lemma in analyses):
+                return True
+        return False
+
+# Sentences the prefilter should leave out, those it should leave out only
+# with initial_capitals, and ones it should not
+CHECK_LEFT_OUT = ['hän osti taloa.', 'se oli hyvä ajatus.', 'kävelimme hitaasti kotiin.', 'sitten he lähtivät.']
+CHECK_LEFT_OUT_CAPITALIZED = ['Hän osti taloa.', 'Se oli hyvä ajatus.', 'Kävelimme hitaasti kotiin.']
+CHECK_KEPT = ['Sauli Niinistö vieraili Helsingissä.', 'Kokous pidetään toukokuussa.', 'Hinta oli kolme euroa.',
+              'He lähtivät Tampereelle.', 'eduskunta hyväksyi lain.', 'valtioneuvosto päätti asiasta.',
+              'talvisota alkoi.', 'olympialaiset pidettiin kesällä.']
+
+def check(datadir, initial_capitals=False):
+    """
+    Returns the sentences of CHECK_LEFT_OUT (and CHECK_LEFT_OUT_CAPITALIZED
+    with *initial_capitals*) that the prefilter does not leave out and those
+    of CHECK_KEPT that it does.
+    """
+    import finer
+    nertagger = finer.Finer(datadir, memo_size=0)
+    prefilter = EntityPrefilter(read_triggers(datadir), initial_capitals)
+    wrong = []
+    for text, expected in ([(text, False) for text in CHECK_LEFT_OUT] +
+                           [(text, not initial_capitals) for text in CHECK_LEFT_OUT_CAPITALIZED] +
+                           [(text, True) for text in CHECK_KEPT]):
+        analysed = nertagger.postagger.analyse(text)
+        sentences = nertagger.postagger.label(analysed)
+        if any(prefilter(sentence, tokens) for sentence, tokens in zip(sentences, analysed)) != expected:
+            wrong.append(text)
+    return wrong
+
+def validate(datadir, filenames, tokenize=True, initial_capitals=False):
+    """
+    Tags the documents in *filenames* both with and without the prefilter
+    and returns the sentences tagged differently, which are those the
+    prefilter left out but the rules tag, with counts and the time the NER
+    stages took each way.
+    """
+    import finer
+    nertagger = finer.Finer(datadir, memo_size=0, lazy=() if tokenize else ('tokenizer',))
+    prefilter = EntityPrefilter(read_triggers(datadir), initial_capitals)
+    result = {'sentences': 0, 'left_out': 0, 'divergent': [], 'seconds': {'full': 0.0, 'prefiltered': 0.0}}
+    for filename in filenames:
+        for document in re.split(r'\n[ \t\r]*\n', open(filename).read()):
+            if document.strip() == '':
+                continue
+            analysed = nertagger.postagger.analyse(document, tokenize)
+            sentences = nertagger.postagger.label(analysed)
+            start = time.perf_counter()
+            full = nertagger.run_stages(sentences)
+            middle = time.perf_counter()
+            prefiltered = nertagger.run_prefiltered(sentences, prefilter, analysed=analysed)
+            result['seconds']['full'] += middle - start
+            result['seconds']['prefiltered'] += time.perf_counter() - middle
+            result['sentences'] += len(sentences)
+            result['left_out'] += sum(1 for sentence, tokens in zip(sentences, analysed) if not prefilter(sentence, tokens))
+            if prefiltered != full:
+                if len(prefiltered) != len(full):
+                    result['divergent'] += full
+                else:
+                    result['divergent'] += [tagged for tagged, other in zip(full, prefiltered) if tagged != other]
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the FiNER entity prefilter against the full rules')
+    parser.add_argument('command', choices=['validate', 'check'])
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--datadir', default=os.environ.get('FINER_DATADIR', '/app/finnish-tagtools/tag'))
+    parser.add_argument('--pretokenized', action='store_true')
+    parser.add_argument('--initial-capitals', action='store_true',
+                        help='let capitals starting a sentence through, as FINER_PREFILTER=initial does')
+    args = parser.parse_args()
+    if args.command == 'check':
+        wrong = check(args.datadir, args.initial_capitals)
+        total = len(CHECK_LEFT_OUT) + len(CHECK_LEFT_OUT_CAPITALIZED) + len(CHECK_KEPT)
+        for text in wrong:
+            print('WRONG: ' + text)
+        print('%d of %d check sentences filtered as expected' % (total - len(wrong), total))
+        sys.exit(1 if wrong else 0)
+    if len(args.files) == 0:
+        parser.error('validate needs the files to validate against')
+    result = validate(args.datadir, args.files, not args.pretokenized, args.initial_capitals)
+    for sentence in result['divergent']:
+        print('DIVERGENT: ' + ' '.join(word if tag == '' else '%s/%s' % (word, tag) for word, tag in sentence))
+    print('%d sentences, %d (%.1f %%) left out by the prefilter, %d divergent' %
+          (result['sentences'], result['left_out'], 100.0 * result['left_out'] / max(1, result['sentences']),
+           len(result['divergent'])))
+    print('NER stages: %.3f s in full, %.3f s prefiltered' % (result['seconds']['full'], result['seconds']['prefiltered']))
+    sys.exit(1 if result['divergent'] else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from cache import LRUCache
+
+log = logging.getLogger('finer')
+
+def datadir_fingerprint(datadir, ignore=None):
+    """
+    Hashes the names, sizes and modification times of the files under
+    *datadir*, so that any change to the models or data files gives a new
+    fingerprint. Files whose path starts with *ignore* are left out.
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(datadir):
+        dirs.sort()
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            if ignore is not None and os.path.abspath(path).startswith(ignore):
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            digest.update(('%s\0%d\0%d\n' % (os.path.relpath(path, datadir), st.st_size, st.st_mtime_ns)).encode('utf-8'))
+    return digest.hexdigest()
+
+# The modules whose code goes into the results
+PIPELINE_MODULES = ('bundle.py', 'finer.py', 'freqwords.py', 'lemmarules.py', 'omorfi_postag.py', 'prefilter.py',
+                    'tagmover.py')
+
+def config_fingerprint(config=None):
+    """
+    Hashes *config*, the settings of the tagger (see Finer.config()), and
+    the source of the pipeline modules, so that results tagged with other
+    settings or another version of the code are not served.
+    """
+    digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode('utf-8'))
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in PIPELINE_MODULES:
+        digest.update(('\0%s\0' % name).encode('utf-8'))
+        try:
+            with open(os.path.join(directory, name), 'rb') as f:
+                digest.update(f.read())
+        except OSError:
+            continue
+    return digest.hexdigest()
+
+def encode(sentences):
+    return json.dumps(sentences, ensure_ascii=False, separators=(',', ':'))
+
+def decode(data):
+    return [[tuple(word) for word in sentence] for sentence in json.loads(data)]
+
+class ResultCache:
+    """
+    Tagging results keyed by a hash of the text, whether it was tokenized
+    and the fingerprints of the data directory and of *config*, the
+    settings of the tagger, together with the pipeline code. Results are kept encoded in
+    an in-process LRU of at most *maxsize* entries and *maxbytes* bytes and,
+    with *path*, in an sqlite database of at most *disk_maxsize* entries
+    that survives restarts. The data directory is fingerprinted again every
+    *check_interval* seconds. Once it has changed, the models loaded from it
+    no longer match the files, so nothing more is cached or served until
+    the process is restarted, and the results stored on disk are dropped by
+    the next process, which loads the new models.
+    """
+    def __init__(self, datadir, maxsize=4096, maxbytes=0, path=None, disk_maxsize=1000000, check_interval=10,
+                 config=None):
+        self.datadir = datadir
+        self.config_fingerprint = config_fingerprint(config)
+        self.check_interval = check_interval
+        self.memory = LRUCache(maxsize, sizeof=len, maxbytes=maxbytes)
+        self.lock = threading.Lock()
+        self.disk_hits = 0
+        self.invalidations = 0
+        self.stale = False
+        self.db = None
+        self.path = path
+        # The database and its journal may well live in the data directory
+        self.ignore = os.path.abspath(path) if path is not None else None
+        self.fingerprint = self.combined_fingerprint()
+        self.checked = time.time()
+        self.disk_maxsize = disk_maxsize
+        if path is not None:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('PRAGMA synchronous=NORMAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, fingerprint TEXT, created REAL, value BLOB)')
+            self.db.execute('DELETE FROM results WHERE fingerprint != ?', (self.fingerprint,))
+            self.db.commit()
+            self.disk_entries = self.db.execute('SELECT count(*) FROM results').fetchone()[0]
+            self.puts = 0
+
+    def check(self):
+        if time.time() - self.checked < self.check_interval:
+            return
+        fingerprint = self.combined_fingerprint()
+        with self.lock:
+            self.checked = time.time()
+            # self.fingerprint stays that of the files the models were
+            # loaded from, so caching resumes if they are put back
+            stale = fingerprint != self.fingerprint
+            if stale == self.stale:
+                return
+            self.stale = stale
+            if stale:
+                self.invalidations += 1
+                self.memory.clear()
+                log.warning('The data directory %s has changed; results are not cached until FiNER is restarted', self.datadir)
+
+    def combined_fingerprint(self):
+        # Stored with each result, so that a restart with anything changed
+        # drops the results of before
+        return hashlib.sha256((datadir_fingerprint(self.datadir, self.ignore) + self.config_fingerprint).encode('ascii')).hexdigest()
+
+    def key(self, text, tokenize):
+        digest = hashlib.sha256(self.fingerprint.encode('ascii'))
+        digest.update(b'\0tokenize\0' if tokenize else b'\0pretokenized\0')
+        digest.update(text.encode('utf-8', 'surrogatepass'))
+        return digest.hexdigest()
+
+    def get(self, text, tokenize=True):
+        self.check()
+        if self.stale:
+            return None
+        key = self.key(text, tokenize)
+        data = self.memory.get(key)
+        if data is None and self.db is not None:
+            with self.lock:
+                row = self.db.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.disk_hits += 1
+            data = zlib.decompress(row[0]).decode('utf-8')
+            self.memory.put(key, data)
+        if data is None:
+            return None
+        return decode(data)
+
+    def put(self, text, tokenize, sentences):
+        if self.stale:
+            return
+        key = self.key(text, tokenize)
+        data = encode(sentences)
+        self.memory.put(key, data)
+        if self.db is None:
+            return
+        with self.lock:
+            cursor = self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                                     (key, self.fingerprint, time.time(), zlib.compress(data.encode('utf-8'))))
+            self.disk_entries += cursor.rowcount
+            self.puts += 1
+            if self.puts % 1000 == 0:
+                # Drop the oldest results beyond the limit now and then
+                self.disk_entries = self.db.execute('SELECT count(*) FROM results').fetchone()[0]
+                if self.disk_entries > self.disk_maxsize:
+                    self.db.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY created LIMIT ?)',
+                                    (self.disk_entries - self.disk_maxsize,))
+                    self.disk_entries = self.disk_maxsize
+            self.db.commit()
+
+    def stats(self):
+        retval = self.memory.stats()
+        # Memory hits, disk hits and misses of the cache as a whole
+        retval['disk_hits'] = self.disk_hits
+        retval['misses'] = retval['misses'] - self.disk_hits
+        lookups = retval['hits'] + retval['misses'] + self.disk_hits
+        retval['hit_ratio'] = (retval['hits'] + self.disk_hits) / lookups if lookups else 0.0
+        retval['invalidations'] = self.invalidations
+        retval['stale'] = int(self.stale)
+        if self.db is not None:
+            retval['disk_size'] = self.disk_entries
+            retval['disk_bytes'] = sum(os.path.getsize(path) for path in (self.path, self.path + '-wal') if os.path.exists(path))
+        return retval
+
+class CachedTagger:
+    """
+    Wraps a tagger (a finer.Finer or a workers.WorkerPool) so that whole
+    documents are looked up in a ResultCache before they are tagged.
+    Streamed blocks are passed through uncached.
+    """
+    def __init__(self, tagger, cache):
+        self.tagger = tagger
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.tagger, name)
+
+    def __call__(self, text, tokenize=True, timings=None):
+        sentences = self.cache.get(text, tokenize)
+        if sentences is not None:
+            if timings is not None:
+                timings.count('cached_documents')
+            return sentences
+        sentences = self.tagger(text, tokenize, timings)
+        self.cache.put(text, tokenize, sentences)
+        return sentences
+
+    def tag_many(self, texts, tokenize=True, timings=None):
+        results = [self.cache.get(text, tokenize) for text in texts]
+        # Each distinct text that missed is tagged once
+        missing = []
+        seen = set()
+        for text, sentences in zip(texts, results):
+            if sentences is None and text not in seen:
+                seen.add(text)
+                missing.append(text)
+        if timings is not None:
+            timings.count('cached_documents', len(texts) - results.count(None))
+        if missing:
+            tagged = dict(zip(missing, self.tagger.tag_many(missing, tokenize, timings)))
+            for text, sentences in tagged.items():
+                self.cache.put(text, tokenize, sentences)
+            results = [tagged[text] if sentences is None else sentences for text, sentences in zip(texts, results)]
+        return results
+
+    def tag_block(self, text, tokenize=True, final=True, timings=None):
+        return self.tagger.tag_block(text, tokenize, final, timings)
@@ -1,25 +1,408 @@
+import os
+import json
+import codecs
+import itertools
+import logging
+import threading
+import columnar
 import finer
-from flask import Flask, request, Response
+import incremental
+import metrics
+import resultcache
+import transport
+import workers
+from flask import Flask, request, Response, stream_with_context
 
 app = Flask(__name__)
 
+batch_size = int(os.environ.get("FINER_BATCH_SIZE", 64))
+stream_block_size = int(os.environ.get("FINER_STREAM_BLOCK_SIZE", 65536))
+# FINER_METRICS=1 times every request for /metrics; a single request can
+# ask for its own timings with an X-Finer-Timing header or a timing parameter
+metrics_enabled = os.environ.get("FINER_METRICS", "0") != "0"
+stats = metrics.Metrics()
+# Request bodies may be gzip or zstd compressed, and responses are
+# compressed for clients that accept it unless smaller than
+# FINER_COMPRESS_MIN_BYTES (see transport.py). Bodies of more than
+# FINER_MAX_BODY_BYTES bytes decoded, or compressed ones of more than
+# FINER_MAX_COMPRESSED_BODY_BYTES as sent, get 413; 0 is no limit
+max_body_bytes = int(os.environ.get("FINER_MAX_BODY_BYTES", 0))
+compress_min_bytes = int(os.environ.get("FINER_COMPRESS_MIN_BYTES", 1024))
+app.wsgi_app = transport.Transport(app.wsgi_app, stats, max_body_bytes,
+                                   int(os.environ.get("FINER_MAX_COMPRESSED_BODY_BYTES", max_body_bytes)),
+                                   compress_min_bytes)
+
+def timing_requested():
+    return request.headers.get("X-Finer-Timing") != None or request.args.get("timing") != None
+
+def request_timings():
+    if metrics_enabled or timing_requested():
+        return metrics.Timings()
+    return None
+
+def finish(response, timings):
+    stats.count("requests")
+    if timings == None:
+        return response
+    timings.count("bytes_out", response.content_length or 0)
+    if metrics_enabled:
+        stats.observe(timings)
+    if timing_requested():
+        value = server_timing(timings)
+        if value != "":
+            response.headers["Server-Timing"] = value
+    return response
+
+def server_timing(timings):
+    # The Server-Timing value for *timings*, which has no stages at all when
+    # the result cache answered
+    value = timings.server_timing()
+    if value == "" and timings.counts.get("cached_documents"):
+        value = "cache;desc=hit"
+    return value
+
+def body_pieces(chunk_size=65536):
+    # Decode the request body incrementally instead of reading it all
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    while True:
+        chunk = request.stream.read(chunk_size)
+        if not chunk:
+            break
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+def body_lines():
+    rest = ""
+    for piece in body_pieces():
+        lines = (rest + piece).split("\n")
+        rest = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    if rest != "":
+        yield rest
+
+class InvalidInput(Exception):
+    # Malformed input found while it is being read and tagged
+    pass
+
+def ndjson_records():
+    # The documents of an NDJSON request body as objects with a string
+    # "text" field, read as they come in
+    for number, line in enumerate(body_lines(), 1):
+        if line.strip() == "":
+            continue
+        try:
+            document = json.loads(line)
+        except ValueError as e:
+            raise InvalidInput("Error - Line %d is not valid JSON: %s" % (number, e))
+        if not isinstance(document, dict):
+            document = {"text": document}
+        if not isinstance(document.get("text", ""), str):
+            raise InvalidInput("Error - The text on line %d should be a string" % number)
+        yield document
+
+def tag_batches(texts, tokenize, timings=None, depth="ner"):
+    # Bound the amount of text held in the pipeline at once, tagging each
+    # batch as soon as *texts* has yielded it
+    tag_many = tagger.morphology_many if depth == "morphology" else tagger.tag_many
+    batch = []
+    for text in texts:
+        batch.append(text)
+        if len(batch) == batch_size:
+            for sentences in tag_many(batch, tokenize, timings):
+                yield sentences
+            batch = []
+    if batch:
+        for sentences in tag_many(batch, tokenize, timings):
+            yield sentences
+
+def columnar_response(mimetype, texts, results, depth, documents=None):
+    # Tokens, character offsets and entity spans in parallel arrays, with
+    # the ids of NDJSON documents
+    values = []
+    for i, (text, sentences) in enumerate(zip(texts, results)):
+        value = columnar.document(text, sentences, depth)
+        if documents != None and "id" in documents[i]:
+            value["id"] = documents[i]["id"]
+        values.append(value)
+    return Response(columnar.encode({"results": values}, mimetype), mimetype=mimetype)
+
+def depth_error(depth):
+    return Response("Error - depth should be one of %s, not '%s'" % (", ".join(finer.DEPTHS), depth),
+                    status=400, mimetype="text/plain")
+
 @app.route('/', methods=['POST', 'GET'])
 def index():
+    # The text is the "text" parameter or a raw text/plain request body
     text = request.values.get("text")
+    if text == None and request.method == "POST" and request.mimetype == "text/plain":
+        text = "".join(body_pieces())
     pretokenized = request.values.get("pretokenized")
     if pretokenized != None:
        tokenize = False
     else:
        tokenize = True
+    # depth=morphology stops after the POS tagger and returns word form,
+    # lemma, label and proper tag annotation for each token
+    depth = request.values.get("depth", "ner")
+    if depth not in finer.DEPTHS:
+        return depth_error(depth)
+    # An Accept header asking for the columnar format gets it instead of TSV
+    mimetype = columnar.negotiate(request.accept_mimetypes)
     if text != None:
-        result = ""
-        for sentence in nertagger(text,tokenize):
-            for word in sentence:
-                result += word[0] + "\t" + word[1] + "\n"
-            result += "\n"
-        return Response(result, mimetype="text/plain")
+        timings = request_timings()
+        if depth == "morphology":
+            sentences = tagger.morphology(text,tokenize,timings)
+        else:
+            sentences = tagger(text,tokenize,timings)
+        if columnar.is_columnar(mimetype):
+            response = Response(columnar.encode(columnar.document(text, sentences, depth), mimetype), mimetype=mimetype)
+        elif depth == "morphology":
+            response = Response(finer.format_morphology(sentences), mimetype="text/plain")
+        else:
+            response = Response(finer.format_sentences(sentences), mimetype="text/plain")
+        return finish(response, timings)
     else:
         return Response("Error - You should provide the input text as 'text' GET/POST parameter", status=500, mimetype="text/plain")
-        
-nertagger = finer.Finer("/app/finnish-tagtools/tag") # pakollinen argumentti joka osoittaa FiNERin käyttämään datahakemistoon
-print("FiNER ready and accepting connections.")
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    # Accepts either a JSON object {"texts": [...], "pretokenized": false} or
+    # NDJSON with one document per line, given as a string or as an object
+    # with a "text" field and an optional "id" that is echoed back. The
+    # columnar format is sent if the Accept header asks for it.
+    tokenize = request.values.get("pretokenized") == None
+    depth = request.values.get("depth", "ner")
+    timings = request_timings()
+    if request.mimetype in ("application/x-ndjson", "application/jsonlines"):
+        if depth not in finer.DEPTHS:
+            return depth_error(depth)
+        # Read line by line, tagging each batch of documents as it comes in
+        documents = []
+        def ndjson_texts():
+            for document in ndjson_records():
+                documents.append(document)
+                yield document.get("text", "")
+        try:
+            results = list(tag_batches(ndjson_texts(), tokenize, timings, depth))
+        except UnicodeDecodeError:
+            return Response("Error - The request body should be UTF-8", status=400, mimetype="text/plain")
+        except InvalidInput as e:
+            return Response(str(e), status=400, mimetype="text/plain")
+        mimetype = columnar.negotiate(request.accept_mimetypes, "application/x-ndjson")
+        if columnar.is_columnar(mimetype):
+            texts = [document.get("text", "") for document in documents]
+            return finish(columnar_response(mimetype, texts, results, depth, documents), timings)
+        lines = []
+        for document, sentences in zip(documents, results):
+            result = {"sentences": sentences}
+            if "id" in document:
+                result["id"] = document["id"]
+            lines.append(json.dumps(result, ensure_ascii=False) + "\n")
+        return finish(Response("".join(lines), mimetype="application/x-ndjson"), timings)
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        texts = data.get("texts")
+        if data.get("pretokenized"):
+            tokenize = False
+        depth = data.get("depth", depth)
+    else:
+        texts = data
+    if not isinstance(texts, list):
+        return Response("Error - You should provide the input texts as a JSON list or as NDJSON", status=400, mimetype="text/plain")
+    if not all(isinstance(text, str) for text in texts):
+        return Response("Error - The input texts should be strings", status=400, mimetype="text/plain")
+    if depth not in finer.DEPTHS:
+        return depth_error(depth)
+    results = list(tag_batches(texts, tokenize, timings, depth))
+    mimetype = columnar.negotiate(request.accept_mimetypes, "application/json")
+    if columnar.is_columnar(mimetype):
+        return finish(columnar_response(mimetype, texts, results, depth), timings)
+    return finish(Response(json.dumps({"results": results}, ensure_ascii=False), mimetype="application/json"), timings)
+
+@app.route('/stream', methods=['POST'])
+def stream():
+    # Tags arbitrarily large input in bounded blocks and sends each sentence
+    # as soon as it is tagged. The input is either the "text" parameter or
+    # the raw request body: running text as text/plain, one token per line
+    # (first column) as text/tab-separated-values, or NDJSON documents.
+    # Output is word-tag TSV, or one JSON object per sentence with
+    # format=ndjson. A sentence longer than finer.MAX_SENTENCE_SIZE
+    # characters is cut into several.
+    tokenize = request.values.get("pretokenized") == None
+    ndjson_out = request.values.get("format") == "ndjson" or request.accept_mimetypes.best == "application/x-ndjson"
+    text = request.args.get("text")
+    if text == None and request.mimetype in ("application/x-www-form-urlencoded", "multipart/form-data"):
+        text = request.form.get("text")
+    if text != None:
+        documents = [[text]]
+    elif request.mimetype in ("application/x-ndjson", "application/jsonlines"):
+        # The first document is read before the response starts, so a body
+        # that isn't NDJSON at all still gets 400
+        records = ndjson_records()
+        try:
+            first = next(records, None)
+        except UnicodeDecodeError:
+            return Response("Error - The request body should be UTF-8", status=400, mimetype="text/plain")
+        except InvalidInput as e:
+            return Response(str(e), status=400, mimetype="text/plain")
+        documents = ([document.get("text", "")] for document in itertools.chain([first] if first != None else [], records))
+    elif request.mimetype == "text/tab-separated-values":
+        tokenize = False
+        documents = [(line.split("\t")[0].rstrip("\n") + "\n" for line in body_lines())]
+    else:
+        documents = [body_pieces()]
+
+    # Timings can't go in a header once the body has started, so a streamed
+    # request only contributes to /metrics
+    timings = metrics.Timings() if metrics_enabled else None
+    stats.count("requests")
+
+    def generate():
+        try:
+            for index, pieces in enumerate(documents):
+                for sentence in finer.stream_blocks(tagger.tag_block, pieces, tokenize, stream_block_size, timings):
+                    if ndjson_out:
+                        output = json.dumps({"document": index, "sentence": sentence}, ensure_ascii=False) + "\n"
+                    else:
+                        output = finer.format_sentences([sentence])
+                    if timings != None:
+                        timings.count("bytes_out", len(output.encode("utf-8")))
+                    yield output
+        except (InvalidInput, UnicodeDecodeError) as e:
+            # Too late for a 400: the error ends the stream as its last record
+            message = str(e) if isinstance(e, InvalidInput) else "Error - The request body should be UTF-8"
+            stats.count("stream_errors")
+            if ndjson_out:
+                yield json.dumps({"error": message}, ensure_ascii=False) + "\n"
+            else:
+                yield message + "\n"
+            return
+        if timings != None:
+            stats.observe(timings)
+
+    mimetype = "application/x-ndjson" if ndjson_out else "text/plain"
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+@app.route('/documents/<document_id>', methods=['POST', 'PUT'])
+def document(document_id):
+    # Tags a revision of a document that is edited and tagged again, given
+    # as a JSON object {"revision": 3, "text": "...", "pretokenized": false}
+    # or as form parameters. Only the sentences the last revision tagged
+    # here did not have are tagged; the result is the same as from "/".
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = request.values
+    text = data.get("text")
+    try:
+        revision = int(data.get("revision", 0))
+    except (TypeError, ValueError):
+        revision = None
+    if not isinstance(text, str) or revision == None:
+        return Response("Error - You should provide the input text as 'text' and an integer 'revision'", status=400, mimetype="text/plain")
+    pretokenized = data.get("pretokenized")
+    tokenize = pretokenized in (None, False, "0", "false")
+    timings = request_timings()
+    sentences, reused = incremental_tagger(document_id, revision, text, tokenize, timings)
+    result = {"id": document_id, "revision": revision, "sentences": sentences, "reused": reused}
+    return finish(Response(json.dumps(result, ensure_ascii=False), mimetype="application/json"), timings)
+
+@app.route('/documents/<document_id>', methods=['DELETE'])
+def forget_document(document_id):
+    return Response(json.dumps({"id": document_id, "deleted": incremental_tagger.forget(document_id)}), mimetype="application/json")
+
+@app.route('/workers', methods=['GET'])
+def worker_stats():
+    if pool == None:
+        return Response(json.dumps({"workers": []}), mimetype="application/json")
+    return Response(json.dumps({"workers": pool.stats()}), mimetype="application/json")
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    # Readiness probe: 200 once the models that are loaded at startup are,
+    # 503 until then, with the load state of each model
+    is_ready = nertagger.ready()
+    return Response(json.dumps({"ready": is_ready, "models": nertagger.status()}), status=200 if is_ready else 503,
+                    mimetype="application/json")
+
+# Cache statistics that only ever grow, exported as counters
+CACHE_COUNTERS = ("hits", "misses", "evictions", "disk_hits", "invalidations")
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    gauges = {}
+    counters = {}
+    caches = []
+    if pool == None:
+        caches += [("analysis_cache", nertagger.postagger.cache), ("lemma_cache", nertagger.lemma_cache),
+                   ("label_memo", nertagger.postagger.sentence_memo), ("sentence_memo", nertagger.sentence_memo)]
+    if result_cache != None:
+        caches.append(("result_cache", result_cache))
+    caches.append(("document_store", incremental_tagger))
+    for name, cache in caches:
+        for key, value in cache.stats().items():
+            if key in CACHE_COUNTERS:
+                counters["%s_%s" % (name, key)] = value
+            else:
+                gauges["%s_%s" % (name, key)] = value
+    if pool != None:
+        worker_stats = pool.stats()
+        gauges["worker_queue_depth"] = dict(('worker="%d"' % i, w["queue_depth"]) for i, w in enumerate(worker_stats))
+        gauges["worker_latency_p99_seconds"] = dict(('worker="%d"' % i, w.get("latency_p99", 0)) for i, w in enumerate(worker_stats))
+    return Response(stats.render(gauges, counters), mimetype="text/plain; version=0.0.4")
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+datadir = os.environ.get("FINER_DATADIR", "/app/finnish-tagtools/tag")
+# FINER_BUNDLE names a bundle compiled from the data directory with
+# bundle.py, shared by all the processes that use it. FINER_FREQ_WORDS_MATCH
+# is "lines" or "words" as the FinnPos model was trained (see freqwords.py).
+# The models load concurrently in the background while the server starts;
+# those listed in FINER_LAZY (eg. "tokenizer" when all input is
+# pretokenized) only load when first needed. With FINER_PREFILTER=1,
+# sentences with no possible entities skip the pmatch phases, and with
+# FINER_PREFILTER=initial also those whose only capital starts the
+# sentence; run "prefilter.py check" and "validate" with the models first
+# (see prefilter.py). FinnPos labels up to FINER_LABEL_BATCH_SIZE sentences a
+# call, in a thread of its own with FINER_LABEL_THREAD=1
+lazy = [name.strip() for name in os.environ.get("FINER_LAZY", "").split(",") if name.strip() != ""]
+nertagger = finer.Finer(datadir, cache_size=int(os.environ.get("FINER_CACHE_SIZE", 65536)),
+                        memo_size=int(os.environ.get("FINER_SENTENCE_MEMO_SIZE", 4096)), lazy=lazy, wait=False,
+                        bundle_file=os.environ.get("FINER_BUNDLE"),
+                        freq_words_match=os.environ.get("FINER_FREQ_WORDS_MATCH", "lines"),
+                        prefilter={"0": False, "initial": "initial"}.get(os.environ.get("FINER_PREFILTER", "0"), True),
+                        label_batch_size=int(os.environ.get("FINER_LABEL_BATCH_SIZE", 64)),
+                        label_thread=os.environ.get("FINER_LABEL_THREAD", "0") != "0") # pakollinen argumentti joka osoittaa FiNERin käyttämään datahakemistoon
+# With FINER_WORKERS set, the models loaded above are shared by that many
+# forked worker processes and requests are spread across them
+worker_count = int(os.environ.get("FINER_WORKERS", 0))
+def announce_ready():
+    nertagger.wait()
+    print("FiNER ready and accepting connections.")
+
+if worker_count > 0:
+    # The workers are forked with the models loaded, so they share them
+    announce_ready()
+    # Single texts of FINER_SHARD_THRESHOLD characters or more are split
+    # at sentence boundaries and tagged in all workers at once
+    pool = workers.WorkerPool(nertagger, worker_count, int(os.environ.get("FINER_SHARD_THRESHOLD", 262144)))
+    tagger = pool
+else:
+    threading.Thread(target=announce_ready, daemon=True).start()
+    pool = None
+    tagger = nertagger
+# FINER_RESULT_CACHE_SIZE documents are kept tagged in memory, up to
+# FINER_RESULT_CACHE_BYTES if set, and with FINER_RESULT_CACHE_DB also in
+# that sqlite file across restarts
+result_cache_size = int(os.environ.get("FINER_RESULT_CACHE_SIZE", 0))
+result_cache_db = os.environ.get("FINER_RESULT_CACHE_DB")
+if result_cache_size > 0 or result_cache_db != None:
+    result_cache = resultcache.ResultCache(datadir, result_cache_size, int(os.environ.get("FINER_RESULT_CACHE_BYTES", 0)),
+                                           result_cache_db, config=nertagger.config())
+    tagger = resultcache.CachedTagger(tagger, result_cache)
+else:
+    result_cache = None
+# The latest tagged revision of FINER_DOCUMENT_STORE_SIZE documents posted
+# to /documents/ is kept, up to about FINER_DOCUMENT_STORE_BYTES if set
+incremental_tagger = incremental.IncrementalTagger(nertagger if pool == None else pool,
+                                                   int(os.environ.get("FINER_DOCUMENT_STORE_SIZE", 1024)),
+                                                   int(os.environ.get("FINER_DOCUMENT_STORE_BYTES", 0)))
@@ -0,0 +1,13 @@
+#!/bin/sh
+# Serves the ASGI app in asgi.py with uvicorn when FINER_ASYNC=1, and
+# otherwise the Flask app in server.py, on FINER_PORT (5000 by default).
+# The Flask app gets a single thread unless FINER_WORKERS is set, as the
+# in-process tagger is not thread safe
+cd /app
+if [ "${FINER_ASYNC:-0}" != "0" ]; then
+    exec uvicorn asgi:app --host 0.0.0.0 --port "${FINER_PORT:-5000}"
+fi
+if [ "${FINER_WORKERS:-0}" = "0" ]; then
+    exec env FLASK_APP=server.py flask run --without-threads --host 0.0.0.0 --port "${FINER_PORT:-5000}"
+fi
+exec env FLASK_APP=server.py flask run --host 0.0.0.0 --port "${FINER_PORT:-5000}"
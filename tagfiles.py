@@ -0,0 +1,306 @@
+"""
+Tags files offline, without going through the HTTP server.
+
+    python tagfiles.py [options] INPUT...
+
+tags the files given, and all files under the directories given, in
+order. The files are memory-mapped and split into documents at blank lines
+(--split blank; for pretokenized input, one token per line, these are the
+sentence boundaries) or at every line end (--split line). The documents
+are tagged in batches of --batch-size documents or --batch-bytes bytes,
+with finer.Finer in this process or, with --workers N, in N forked worker
+processes, and written in input order as word-tag TSV or, with --format
+ndjson, one JSON object per document with the file, the byte offset of the
+document in it and its sentences. Only a few batches are in flight at a
+time, and a document of more than --batch-bytes bytes, such as running
+text without blank lines, is read and tagged a block at a time with
+Finer.tag_block(), so memory use does not grow with the input. With
+--format ndjson, the sentences of such a document are written in several
+objects with the same offset, numbered by a "part" field.
+
+With --checkpoint FILE, the input position and the length of the output
+written so far are recorded there after every batch, and a run started
+again with the same arguments picks up from there, truncating the output
+file to what it had written. A run with another format, split, depth or
+pretokenized setting, or without the output file of the checkpoint, does
+not resume from it.
+"""
+import argparse
+import codecs
+import json
+import logging
+import mmap
+import os
+import re
+import sys
+import time
+from collections import deque
+import finer
+import workers
+
+log = logging.getLogger('finer')
+
+blank_line_re = re.compile(rb'\r?\n(?:[ \t\r]*\n)+')
+
+# Characters tagged at a time in a document too large for a batch
+STREAM_BLOCK_SIZE = 65536
+
+def input_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for filename in sorted(files):
+                    yield os.path.join(root, filename)
+        else:
+            yield path
+
+def document_spans(data, start, split):
+    """
+    Yields the (start, end) byte offsets of the non-blank documents in
+    *data* from *start* on, each followed by the offset to resume from
+    after it.
+    """
+    position = start
+    while position < len(data):
+        if split == 'line':
+            end = data.find(b'\n', position)
+            following = len(data) if end == -1 else end + 1
+            if end == -1:
+                end = len(data)
+        else:
+            match = blank_line_re.search(data, position)
+            end = len(data) if match is None else match.start()
+            following = len(data) if match is None else match.end()
+        if data[position:end].strip() != b'':
+            yield position, end, following
+        position = following
+
+def document_pieces(data, start, end, size=STREAM_BLOCK_SIZE):
+    # The text of a document, decoded a piece at a time
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    for position in range(start, end, size):
+        yield decoder.decode(data[position:min(end, position + size)])
+    yield decoder.decode(b'', final=True)
+
+def batches(filenames, split, batch_size, batch_bytes, checkpoint=None):
+    """
+    Yields (filename, [(offset, text), ...], resume offset) for batches of
+    documents, starting from where *checkpoint* left off. A document of
+    more than *batch_bytes* bytes comes in a batch of its own, with an
+    iterable of pieces of its text in place of the text.
+    """
+    skipping = checkpoint is not None
+    for filename in filenames:
+        start = 0
+        if skipping:
+            if filename != checkpoint['file']:
+                continue
+            skipping = False
+            start = checkpoint['offset']
+        with open(filename, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= start:
+                continue
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                batch = []
+                length = 0
+                for begin, end, following in document_spans(data, start, split):
+                    if end - begin > batch_bytes:
+                        if batch:
+                            yield filename, batch, begin
+                            batch = []
+                            length = 0
+                        yield filename, [(begin, document_pieces(data, begin, end))], following
+                        continue
+                    batch.append((begin, data[begin:end].decode('utf-8', 'replace')))
+                    length += end - begin
+                    if len(batch) >= batch_size or length >= batch_bytes:
+                        yield filename, batch, following
+                        batch = []
+                        length = 0
+                if batch:
+                    yield filename, batch, size
+            finally:
+                data.close()
+    if skipping:
+        raise ValueError('%s from the checkpoint is not among the input files' % checkpoint['file'])
+
+def format_document(filename, offset, sentences, output_format, depth='ner', part=None):
+    if output_format == 'ndjson':
+        document = {'file': filename, 'offset': offset, 'sentences': sentences}
+        if part is not None:
+            document['part'] = part
+        return json.dumps(document, ensure_ascii=False) + '\n'
+    if depth == 'morphology':
+        return finer.format_morphology(sentences)
+    return finer.format_sentences(sentences)
+
+def read_checkpoint(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def checkpoint_settings(output_format, split, tokenize, depth):
+    # What the output written so far depends on besides the input
+    return {'format': output_format, 'split': split, 'pretokenized': not tokenize, 'depth': depth}
+
+def check_checkpoint(checkpoint, settings):
+    if checkpoint.get('settings') != settings:
+        raise ValueError('the checkpoint was written with %s, not %s' %
+                         (json.dumps(checkpoint.get('settings'), sort_keys=True), json.dumps(settings, sort_keys=True)))
+
+def write_checkpoint(filename, state):
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(filename + '.tmp', filename)
+
+class Done:
+    # The result of a batch tagged in this process, in place of a Future
+    def __init__(self, result):
+        self.value = result
+
+    def result(self):
+        return self.value
+
+def tag_files(nertagger, filenames, output, output_format='tsv', split='blank', tokenize=True, processes=0,
+              batch_size=64, batch_bytes=1 << 20, checkpoint_file=None, output_bytes=0, depth='ner'):
+    """
+    Tags the documents in *filenames* with *nertagger* (a finer.Finer),
+    in *processes* worker processes if more than one, and writes them to
+    the binary file *output*, which already holds *output_bytes* bytes of
+    output. With *depth* 'morphology', the documents only go through the
+    POS tagger. Returns the number of documents and of bytes written.
+    """
+    settings = checkpoint_settings(output_format, split, tokenize, depth)
+    checkpoint = read_checkpoint(checkpoint_file) if checkpoint_file is not None else None
+    if checkpoint is not None:
+        check_checkpoint(checkpoint, settings)
+    method = 'morphology_many' if depth == 'morphology' else 'tag_many'
+    pool = workers.WorkerPool(nertagger, processes) if processes > 1 else None
+    tagger = nertagger if pool is None else pool
+    tag_block = tagger.morphology_block if depth == 'morphology' else tagger.tag_block
+    # Enough batches queued to keep every worker busy, and no more
+    limit = 0 if pool is None else 2 * processes
+    in_flight = deque()
+    documents = 0
+    started = time.time()
+
+    def write(data):
+        nonlocal output_bytes
+        data = data.encode('utf-8')
+        output.write(data)
+        output_bytes += len(data)
+
+    def finished(filename, count, resume):
+        nonlocal documents
+        output.flush()
+        documents += count
+        if checkpoint_file is not None:
+            write_checkpoint(checkpoint_file, {'file': filename, 'offset': resume, 'output_bytes': output_bytes,
+                                               'settings': settings})
+
+    def finish_batch():
+        filename, batch, resume, future = in_flight.popleft()
+        for (offset, text), sentences in zip(batch, future.result()):
+            write(format_document(filename, offset, sentences, output_format, depth))
+        finished(filename, len(batch), resume)
+
+    def stream_document(filename, offset, pieces, resume):
+        # Written as it is tagged, in parts of about a block for NDJSON
+        part = []
+        size = 0
+        parts = 0
+        for sentence in finer.stream_blocks(tag_block, pieces, tokenize, STREAM_BLOCK_SIZE):
+            if output_format != 'ndjson':
+                write(format_document(filename, offset, [sentence], output_format, depth))
+                continue
+            part.append(sentence)
+            size += sum(len(word[0]) + 1 for word in sentence)
+            if size >= STREAM_BLOCK_SIZE:
+                write(format_document(filename, offset, part, output_format, depth, parts))
+                parts += 1
+                part = []
+                size = 0
+        if output_format == 'ndjson' and (part or parts == 0):
+            write(format_document(filename, offset, part, output_format, depth, parts))
+        finished(filename, 1, resume)
+
+    try:
+        for filename, batch, resume in batches(filenames, split, batch_size, batch_bytes, checkpoint):
+            if not isinstance(batch[0][1], str):
+                # Everything before it is written first
+                while in_flight:
+                    finish_batch()
+                stream_document(filename, batch[0][0], batch[0][1], resume)
+                continue
+            texts = [text for offset, text in batch]
+            if pool is None:
+                future = Done(getattr(nertagger, method)(texts, tokenize))
+            else:
+                future = pool.submit(method, (texts, tokenize))
+            in_flight.append((filename, batch, resume, future))
+            while len(in_flight) > limit:
+                finish_batch()
+        while in_flight:
+            finish_batch()
+    finally:
+        if pool is not None:
+            pool.close()
+    seconds = time.time() - started
+    log.info('Tagged %d documents in %.1f s (%.1f documents/s)', documents, seconds, documents / seconds if seconds else 0.0)
+    return documents, output_bytes
+
+def main():
+    parser = argparse.ArgumentParser(description='Tag files with FiNER')
+    parser.add_argument('inputs', nargs='+', help='files, or directories of files, to tag')
+    parser.add_argument('--datadir', default=os.environ.get('FINER_DATADIR', '/app/finnish-tagtools/tag'))
+    parser.add_argument('--bundle', help='a bundle compiled from the data directory with bundle.py')
+    parser.add_argument('--freq-words-match', default='lines', choices=['lines', 'words'])
+    parser.add_argument('--output', '-o', help='output file, standard output by default')
+    parser.add_argument('--format', default='tsv', choices=['tsv', 'ndjson'])
+    parser.add_argument('--split', default='blank', choices=['blank', 'line'],
+                        help='documents end at blank lines or at every line end')
+    parser.add_argument('--pretokenized', action='store_true', help='the input has one token per line')
+    parser.add_argument('--workers', type=int, default=0, help='number of worker processes')
+    parser.add_argument('--batch-size', type=int, default=64, help='documents per batch')
+    parser.add_argument('--batch-bytes', type=int, default=1 << 20, help='bytes of input per batch')
+    parser.add_argument('--depth', default='ner', choices=finer.DEPTHS,
+                        help='morphology stops after the POS tagger')
+    parser.add_argument('--prefilter', action='store_true', help='skip the pmatch phases where no entity can be found')
+    parser.add_argument('--checkpoint', help='record progress here and resume from it')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    checkpoint = read_checkpoint(args.checkpoint) if args.checkpoint is not None else None
+    output_bytes = 0 if checkpoint is None else checkpoint['output_bytes']
+    if checkpoint is not None:
+        # The output before the checkpoint is not written again
+        try:
+            check_checkpoint(checkpoint, checkpoint_settings(args.format, args.split, not args.pretokenized, args.depth))
+        except ValueError as e:
+            parser.error('can not resume from %s: %s' % (args.checkpoint, e))
+        if args.output is None or not os.path.exists(args.output) or os.path.getsize(args.output) < output_bytes:
+            parser.error('can not resume from %s without the %d bytes of output written to --output before it' %
+                         (args.checkpoint, output_bytes))
+    if args.output is None:
+        output = sys.stdout.buffer
+    elif checkpoint is not None:
+        # Drop whatever was written after the last checkpoint
+        output = open(args.output, 'r+b')
+        output.truncate(output_bytes)
+        output.seek(output_bytes)
+    else:
+        output = open(args.output, 'wb')
+    nertagger = finer.Finer(args.datadir, lazy=('tokenizer',) if args.pretokenized else (), bundle_file=args.bundle,
+                            freq_words_match=args.freq_words_match, prefilter=args.prefilter)
+    tag_files(nertagger, list(input_files(args.inputs)), output, args.format, args.split, not args.pretokenized,
+              args.workers, args.batch_size, args.batch_bytes, args.checkpoint, output_bytes, args.depth)
+    if output is not sys.stdout.buffer:
+        output.close()
+
+if __name__ == '__main__':
+    main()
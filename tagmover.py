@@ -0,0 +1,203 @@
+"""
+Moves the Enamex/Timex/Numex/Exc tags that the proper name pmatch phases
+put around lines of FiNER input into the tag columns 5 to 8, by nesting
+depth.
+
+cascade_line() is the original series of regular expression passes and
+the reference for what the result must be. move_line() gets the same
+result by parsing the tags of a line once and carrying out only the steps
+of the cascade that can change that line; it falls back to cascade_line()
+for lines whose tags it can't parse.
+"""
+import re
+
+TAG_TYPES = ('Enamex', 'Timex', 'Numex', 'Exc')
+
+open_and_close_tag_re = re.compile(r'<((Enamex|Timex|Numex|Exc)[^>]+)>(.+)</\1>')
+open_and_close_tag_re_replacement = r'\3<\1/>'
+open_tag_re = re.compile(r'^(<(Enamex|Timex|Numex|Exc)[^>]+>)([^\t].*)$')
+open_tag_re_replacement = r'\3\1'
+nested_tag_4 = re.compile(r'(</?(Enamex|Timex|Numex)[^>]+4/?>)([^\t]*\t[^\t]*\t[^\t]*\t)')
+nested_tag_3 = re.compile(r'(</?(Enamex|Timex|Numex)[^>]+3/?>)([^\t]*\t[^\t]*\t)')
+nested_tag_2 = re.compile(r'(</?(Enamex|Timex|Numex)[^>]+2/?>)([^\t]*\t)')
+nested_tag_1 = re.compile(r'\t+(<(Enamex|Timex|Numex)[^>]+1>)')
+nested_tag_1_replacement = r'\t\1'
+nested_tags = re.compile(r'(</?(Enamex|Timex|Numex)[^>1234]+)[1234](/?>)')
+nested_tags_replacement = r'\1\3'
+
+tag_split_re = re.compile(r'(<[^<>]*>)')
+
+def cascade_line(line):
+    line = open_and_close_tag_re.sub(open_and_close_tag_re_replacement, line)
+    line = open_tag_re.sub(open_tag_re_replacement, line)
+    fields = line.count('\t') + 1
+    if fields < 8:
+        line = line + (8 - fields) * '\t'
+    line = nested_tag_4.sub(open_tag_re_replacement, line)
+    line = nested_tag_3.sub(open_tag_re_replacement, line)
+    line = nested_tag_2.sub(open_tag_re_replacement, line)
+    line = nested_tag_1.sub(nested_tag_1_replacement, line)
+    line = nested_tags.sub(nested_tags_replacement, line)
+    return line
+
+class Tag:
+    """
+    What the cascade needs to know about a tag: whether it is a closing
+    tag, its type, the rest of its name, its depth digit for nested_tag_2..4
+    if any, whether nested_tag_1 pulls it back, and its text without the
+    depth digit (nested_tags).
+    """
+    __slots__ = ('closing', 'type', 'tail', 'depth', 'open_1', 'plain')
+
+    def __init__(self, text):
+        self.closing = text.startswith('</')
+        name = text[2:-1] if self.closing else text[1:-1]
+        self.type = self.tail = self.depth = None
+        self.open_1 = False
+        self.plain = text
+        for type in TAG_TYPES:
+            if name.startswith(type) and len(name) > len(type) and '\t' not in name:
+                self.type = type
+                self.tail = name[len(type):]
+                break
+        if self.type is None or self.type == 'Exc':
+            return
+        slash = self.tail.endswith('/')
+        core = self.tail[:-1] if slash else self.tail
+        if len(core) >= 2 and core[-1] in '1234':
+            self.depth = core[-1]
+            self.open_1 = not self.closing and not slash and self.depth == '1'
+            if not any(digit in core[:-1] for digit in '1234'):
+                self.plain = '<' + ('/' if self.closing else '') + self.type + core[:-1] + ('/' if slash else '') + '>'
+
+# Tag by text; there are only so many different tags
+tags = {}
+
+def tag(text):
+    info = tags.get(text)
+    if info is None:
+        if len(tags) > 10000:
+            tags.clear()
+        info = tags[text] = Tag(text)
+    return info
+
+def parse(line):
+    """
+    Splits a line into text and tag segments, tags being the ones starting
+    with <, or returns None if it has a < or > outside a tag or a tag that
+    is not one of ours.
+    """
+    parts = tag_split_re.split(line)
+    count = len(parts) // 2
+    if line.count('<') != count or line.count('>') != count:
+        return None
+    for i in range(1, len(parts), 2):
+        if tag(parts[i]).type is None:
+            return None
+    return [part for part in parts if part != '']
+
+def join_text(segments):
+    # Merges neighbouring text segments
+    retval = []
+    for segment in segments:
+        if retval and segment[0] != '<' and retval[-1][0] != '<':
+            retval[-1] += segment
+        else:
+            retval.append(segment)
+    return retval
+
+def close_pairs(segments):
+    # open_and_close_tag_re: <X>...</X> becomes ...<X/>, taking the last </X>
+    retval = []
+    i = 0
+    while i < len(segments):
+        segment = segments[i]
+        if segment[0] == '<' and segment[1] != '/':
+            closing = '</' + segment[1:]
+            j = len(segments) - 1
+            while j > i + 1 and segments[j] != closing:
+                j -= 1
+            if j > i + 1:
+                retval.extend(segments[i + 1:j])
+                retval.append(segment[:-1] + '/>')
+                i = j + 1
+                continue
+        retval.append(segment)
+        i += 1
+    return retval
+
+def shift(segments, depth, tabs):
+    # nested_tag_2..4: a tag of *depth* moves past the next *tabs* tabs
+    retval = []
+    segments = list(segments)
+    i = 0
+    while i < len(segments):
+        segment = segments[i]
+        if segment[0] == '<' and tag(segment).depth == depth:
+            moved = []
+            need = tabs
+            j = i + 1
+            while need > 0 and j < len(segments):
+                following = segments[j]
+                if following[0] == '<' or following.count('\t') < need:
+                    if following[0] != '<':
+                        need -= following.count('\t')
+                    moved.append(following)
+                    j += 1
+                    continue
+                cut = -1
+                for k in range(need):
+                    cut = following.index('\t', cut + 1)
+                moved.append(following[:cut + 1])
+                need = 0
+                if cut + 1 < len(following):
+                    segments[j] = following[cut + 1:]
+                else:
+                    j += 1
+            if need == 0:
+                retval.extend(moved)
+                retval.append(segment)
+                i = j
+                continue
+        retval.append(segment)
+        i += 1
+    return join_text(retval)
+
+def move_line(line):
+    if '<' not in line and '>' not in line:
+        # Nothing to move, only the columns to fill up
+        fields = line.count('\t') + 1
+        if fields < 8:
+            return line + (8 - fields) * '\t'
+        return line
+    segments = parse(line)
+    if segments is None:
+        return cascade_line(line)
+    if '</' in line:
+        segments = close_pairs(segments)
+    # open_tag_re: a tag starting the line goes to its end, unless a tab follows
+    if (len(segments) > 1 and segments[0][0] == '<' and segments[0][1] != '/' and
+            not segments[1].startswith('\t')):
+        segments = segments[1:] + segments[:1]
+    segments = join_text(segments)
+    fields = line.count('\t') + 1
+    if fields < 8:
+        segments = join_text(segments + [(8 - fields) * '\t'])
+    depths = set(tag(segment).depth for segment in segments if segment[0] == '<')
+    for depth, tabs in (('4', 3), ('3', 2), ('2', 1)):
+        if depth in depths:
+            segments = shift(segments, depth, tabs)
+    if '1' in depths:
+        for i in range(1, len(segments)):
+            if segments[i][0] == '<' and tag(segments[i]).open_1 and segments[i - 1].endswith('\t'):
+                segments[i - 1] = segments[i - 1].rstrip('\t') + '\t'
+    return ''.join(segment if segment[0] != '<' else tag(segment).plain for segment in segments)
+
+def move_tags(s, move_line=move_line):
+    lines = []
+    for line in s.split('\n'):
+        if line == '.#.':
+            lines.append(line)
+            continue
+        lines.append(move_line(line))
+    return '\n'.join(lines) + '\n'
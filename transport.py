@@ -0,0 +1,228 @@
+"""
+Compressed request and response bodies, body size limits and byte counts
+for the Flask app in server.py, as WSGI middleware.
+
+A request body with Content-Encoding gzip or zstd (zstd needs the
+zstandard package) is decompressed as the app reads it, so whatever reads
+it, form parsing, request.get_json() or the incremental readers of /batch
+and /stream, sees plain bytes and can start before the whole body is in.
+A body of more than max_body_bytes bytes, after decoding, or a compressed
+one of more than max_compressed_bytes as sent gets 413, an unknown
+encoding 415 and a corrupt body 400.
+
+A response is compressed with zstd or gzip if the client accepts it and
+it is not smaller than min_bytes; a streamed response is flushed after
+every chunk, so that each tagged sentence still goes out as soon as it is
+ready.
+
+The bytes received and sent, before and after decoding, are counted in
+a metrics.Metrics as request_wire_bytes, request_body_bytes,
+response_body_bytes and response_wire_bytes.
+"""
+import gzip
+import io
+import zlib
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge, UnsupportedMediaType
+from werkzeug.http import parse_accept_header
+from werkzeug.wsgi import LimitedStream
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Fast levels, as the responses are large and the tagging already slow
+GZIP_LEVEL = 1
+ZSTD_LEVEL = 3
+
+DECODE_ERRORS = (OSError, EOFError, zlib.error) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+def decoders():
+    retval = {'gzip': gzip_reader, 'x-gzip': gzip_reader}
+    if zstandard is not None:
+        retval['zstd'] = zstd_reader
+    return retval
+
+def encodings():
+    # In order of preference
+    return (['zstd'] if zstandard is not None else []) + ['gzip']
+
+def gzip_reader(stream):
+    return gzip.GzipFile(fileobj=stream, mode='rb')
+
+def zstd_reader(stream):
+    return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True))
+
+class CountingReader:
+    """
+    A wsgi.input reading from *stream*, counting the bytes read as each of
+    *names* in *stats* and raising RequestEntityTooLarge once there are more
+    than *limit* of them, unless it is 0. Errors from *stream* are the
+    client's, turned into BadRequest.
+    """
+    def __init__(self, stream, stats, names, limit=0):
+        self.stream = stream
+        self.stats = stats
+        self.names = names
+        self.limit = limit
+        self.bytes = 0
+
+    def counted(self, data):
+        self.bytes += len(data)
+        if self.limit and self.bytes > self.limit:
+            raise RequestEntityTooLarge()
+        for name in self.names:
+            self.stats.count(name, len(data))
+        return data
+
+    def read(self, size=-1):
+        try:
+            return self.counted(self.stream.read(-1 if size is None else size))
+        except DECODE_ERRORS as e:
+            raise BadRequest('Error - the request body could not be decoded: %s' % e)
+
+    def readline(self, size=-1):
+        try:
+            return self.counted(self.stream.readline(-1 if size is None else size))
+        except DECODE_ERRORS as e:
+            raise BadRequest('Error - the request body could not be decoded: %s' % e)
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+
+def compressor(encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+def flush_mode(encoding):
+    # Ends what has been compressed so far so that the client can decode it
+    return zstandard.COMPRESSOBJ_FLUSH_BLOCK if encoding == 'zstd' else zlib.Z_SYNC_FLUSH
+
+def response_encoding(accept_encoding):
+    # The encoding to use for the Accept-Encoding header *accept_encoding*, if any
+    return parse_accept_header(accept_encoding).best_match(encodings())
+
+def compress(body, encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    return gzip.compress(body, GZIP_LEVEL)
+
+class Transport:
+    """
+    Wraps the WSGI application *app*; see the module docstring.
+    """
+    def __init__(self, app, stats, max_body_bytes=0, max_compressed_bytes=0, min_bytes=1024):
+        self.app = app
+        self.stats = stats
+        self.max_body_bytes = max_body_bytes
+        self.max_compressed_bytes = max_compressed_bytes
+        self.min_bytes = min_bytes
+
+    def decode_request(self, environ):
+        """
+        Puts a reader that decodes and counts the request body in *environ*,
+        or returns the error to respond with.
+        """
+        encoding = environ.get('HTTP_CONTENT_ENCODING', 'identity').strip().lower()
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or -1)
+        except ValueError:
+            length = -1
+        if encoding in ('', 'identity'):
+            if self.max_body_bytes and length > self.max_body_bytes:
+                return RequestEntityTooLarge()
+            environ['wsgi.input'] = CountingReader(environ['wsgi.input'], self.stats,
+                                                   ('request_wire_bytes', 'request_body_bytes'), self.max_body_bytes)
+            return None
+        decoder = decoders().get(encoding)
+        if decoder is None:
+            return UnsupportedMediaType('Error - Content-Encoding should be one of %s, not %s' %
+                                        (', '.join(sorted(decoders())), encoding))
+        if self.max_compressed_bytes and length > self.max_compressed_bytes:
+            return RequestEntityTooLarge()
+        stream = environ['wsgi.input']
+        if not environ.get('wsgi.input_terminated'):
+            # The decoder reads ahead, so it must not read past the body
+            stream = LimitedStream(stream, length) if length >= 0 else io.BytesIO()
+        wire = CountingReader(stream, self.stats, ('request_wire_bytes',), self.max_compressed_bytes)
+        environ['wsgi.input'] = CountingReader(decoder(wire), self.stats, ('request_body_bytes',), self.max_body_bytes)
+        # The length of the decoded body is not known, the app reads it to its end
+        environ['wsgi.input_terminated'] = True
+        environ.pop('CONTENT_LENGTH', None)
+        environ.pop('HTTP_CONTENT_ENCODING', None)
+        return None
+
+    def __call__(self, environ, start_response):
+        error = self.decode_request(environ)
+        if error is not None:
+            return error(environ, start_response)
+        encoding = response_encoding(environ.get('HTTP_ACCEPT_ENCODING'))
+        response = {}
+
+        def capture(status, headers, exc_info=None):
+            response['status'] = status
+            response['headers'] = headers
+            response['exc_info'] = exc_info
+
+        result = self.app(environ, capture)
+        headers = response['headers']
+        names = set(name.lower() for name, value in headers)
+        length = None
+        for name, value in headers:
+            if name.lower() == 'content-length':
+                length = int(value)
+        if (encoding is None or 'content-encoding' in names or response['status'][:3] in ('204', '304') or
+                environ['REQUEST_METHOD'] == 'HEAD' or (length is not None and length < self.min_bytes)):
+            start_response(response['status'], headers, response['exc_info'])
+            if length is not None:
+                self.stats.count('response_body_bytes', length)
+                self.stats.count('response_wire_bytes', length)
+                return result
+            return self.counted(result)
+        headers = [(name, value) for name, value in headers if name.lower() != 'content-length']
+        headers += [('Content-Encoding', encoding), ('Vary', 'Accept-Encoding')]
+        if length is not None:
+            try:
+                body = b''.join(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+            data = compress(body, encoding)
+            self.stats.count('response_body_bytes', len(body))
+            self.stats.count('response_wire_bytes', len(data))
+            start_response(response['status'], headers + [('Content-Length', str(len(data)))], response['exc_info'])
+            return [data]
+        start_response(response['status'], headers, response['exc_info'])
+        return self.compressed(result, encoding)
+
+    def counted(self, result):
+        try:
+            for chunk in result:
+                self.stats.count('response_body_bytes', len(chunk))
+                self.stats.count('response_wire_bytes', len(chunk))
+                yield chunk
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    def compressed(self, result, encoding):
+        compressobj = compressor(encoding)
+        try:
+            for chunk in result:
+                if not chunk:
+                    continue
+                data = compressobj.compress(chunk) + compressobj.flush(flush_mode(encoding))
+                self.stats.count('response_body_bytes', len(chunk))
+                self.stats.count('response_wire_bytes', len(data))
+                yield data
+            data = compressobj.flush()
+            self.stats.count('response_wire_bytes', len(data))
+            yield data
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
@@ -0,0 +1,202 @@
+import itertools
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+import metrics
+
+def serve(tagger, conn):
+    # Worker process main loop: run tagger methods until the parent hangs up
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        job_id, method, args, timed = job
+        try:
+            if timed:
+                # Stage timings are collected here and sent back with the result
+                timings = metrics.Timings()
+                result = (True, (getattr(tagger, method)(*args, timings=timings), timings))
+            else:
+                result = (True, getattr(tagger, method)(*args))
+        except Exception as e:
+            result = (False, e)
+        try:
+            conn.send((job_id,) + result)
+        except Exception as e:
+            # The result or exception could not be pickled
+            conn.send((job_id, False, RuntimeError(repr(e))))
+    conn.close()
+
+class Worker:
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.completed = 0
+        self.errors = 0
+        self.restarts = -1
+        self.latencies = deque(maxlen=1000)
+        self.start()
+
+    def start(self):
+        self.conn, child_conn = self.pool.context.Pipe()
+        self.process = self.pool.context.Process(target=serve, args=(self.pool.tagger, child_conn),
+                                                 name="finer-worker-%d" % self.index, daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.restarts += 1
+        self.collector = threading.Thread(target=self.collect, args=(self.conn,), daemon=True)
+        self.collector.start()
+
+    def submit(self, job_id, method, args, timed):
+        future = Future()
+        with self.lock:
+            self.pending[job_id] = (future, time.time())
+            self.conn.send((job_id, method, args, timed))
+        return future
+
+    def collect(self, conn):
+        while True:
+            try:
+                job_id, ok, result = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self.lock:
+                future, started = self.pending.pop(job_id)
+                self.latencies.append(time.time() - started)
+                self.completed += 1
+                if not ok:
+                    self.errors += 1
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+        self.died(conn)
+
+    def died(self, conn):
+        # The replacement is forked while no request thread is using the
+        # parent's tagger, so that it doesn't inherit a lock held mid-call
+        with self.pool.shard_lock, self.lock:
+            if conn is not self.conn or self.pool.closed:
+                return
+            pending = self.pending
+            self.pending = {}
+            for future, started in pending.values():
+                self.errors += 1
+                future.set_exception(RuntimeError("FiNER worker %d exited" % self.index))
+            # The models are still loaded in the parent, so forking a
+            # replacement is cheap
+            self.start()
+
+    def depth(self):
+        return len(self.pending)
+
+    def stats(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+        retval = {'pid': self.process.pid, 'queue_depth': self.depth(), 'completed': self.completed,
+                  'errors': self.errors, 'restarts': self.restarts}
+        if latencies:
+            retval['latency_p50'] = latencies[len(latencies) // 2]
+            retval['latency_p99'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            retval['latency_max'] = latencies[-1]
+        return retval
+
+class WorkerPool:
+    """
+    Serves an already loaded tagger from *processes* forked worker processes.
+    The models are loaded once in the parent and shared with the workers
+    copy-on-write, so each worker only adds the memory it writes to.
+
+    Texts of at least *shard_threshold* characters (0 for none) are
+    tokenized in the parent, split into one shard of sentences per worker
+    and tagged in all of them at once.
+    """
+    def __init__(self, tagger, processes, shard_threshold=0):
+        self.tagger = tagger
+        self.shard_threshold = shard_threshold
+        # The parent's tagger is only used for sharding, one text at a time,
+        # and is left alone while a worker is forked
+        self.shard_lock = threading.Lock()
+        self.context = multiprocessing.get_context('fork')
+        self.closed = False
+        self.job_ids = itertools.count()
+        self.workers = [Worker(self, index) for index in range(processes)]
+
+    def submit(self, method, args, timed=False):
+        # Send the job to the worker with the fewest outstanding jobs, taking
+        # turns between equally loaded ones
+        job_id = next(self.job_ids)
+        start = job_id % len(self.workers)
+        worker = min(self.workers[start:] + self.workers[:start], key=lambda w: w.depth())
+        return worker.submit(job_id, method, args, timed)
+
+    def call(self, method, args, timings=None):
+        """
+        Runs a tagger method in a worker and waits for the result. Stage
+        timings measured in the worker are added to *timings*, if given.
+        """
+        if timings is None:
+            return self.submit(method, args).result()
+        result, worker_timings = self.submit(method, args, True).result()
+        timings.merge(worker_timings)
+        return result
+
+    def __call__(self, text, tokenize=True, timings=None):
+        if self.shard_threshold > 0 and len(self.workers) > 1 and len(text) >= self.shard_threshold:
+            return self.tag_sharded(text, tokenize, timings)
+        return self.call('__call__', (text, tokenize), timings)
+
+    def tag_sharded(self, text, tokenize=True, timings=None):
+        with self.shard_lock:
+            shards = self.tagger.shard(text, tokenize, len(self.workers), timings)
+        futures = [self.submit('tag_analysed', (shard,), timings is not None) for shard in shards]
+        retval = []
+        for future in futures:
+            if timings is None:
+                retval.extend(future.result())
+            else:
+                result, worker_timings = future.result()
+                timings.merge(worker_timings)
+                retval.extend(result)
+        return retval
+
+    def morphology(self, text, tokenize=True, timings=None):
+        return self.call('morphology', (text, tokenize), timings)
+
+    def morphology_many(self, texts, tokenize=True, timings=None):
+        return self.call('morphology_many', (texts, tokenize), timings)
+
+    def analyse(self, text, tokenize=True, timings=None):
+        # Tokenizing and lookup happen in the parent, like for sharding
+        with self.shard_lock:
+            return self.tagger.analyse(text, tokenize, timings)
+
+    def tag_analysed(self, sentences, timings=None):
+        return self.call('tag_analysed', (sentences,), timings)
+
+    def tag_many(self, texts, tokenize=True, timings=None):
+        return self.call('tag_many', (texts, tokenize), timings)
+
+    def tag_block(self, text, tokenize=True, final=True, timings=None):
+        return self.call('tag_block', (text, tokenize, final), timings)
+
+    def morphology_block(self, text, tokenize=True, final=True, timings=None):
+        return self.call('morphology_block', (text, tokenize, final), timings)
+
+    def stats(self):
+        return [worker.stats() for worker in self.workers]
+
+    def close(self):
+        self.closed = True
+        for worker in self.workers:
+            with worker.lock:
+                worker.conn.send(None)
+            worker.process.join()
+            worker.conn.close()